@@ -0,0 +1,406 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import aiomisc
+from sqlalchemy import case, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from api.drivers_services.driver_licence import TestyNaprawoJazdyApi
+from database.engine import get_engine
+from database.notify import notify_course_changed
+from database.models import (
+    Module, Subject, Slide, Attachment, AudioDubbing, ResourceValidator, SynthesisFailure, content_hash
+)
+from models.request import CourseModule, Subject as SubjectModel, Slaid, Validators
+
+# marks the end of the stream in a pipeline queue
+_DONE = object()
+
+# the attachment fields stored from the slide payload
+ATTACHMENT_COLUMNS = (Attachment.name, Attachment.type, Attachment.file, Attachment.autostart)
+
+
+class CourseCrawler(aiomisc.Service):
+    """
+    Walks the whole course tree (modules -> subjects -> slides -> images) and
+    stores it in the `modules`, `subjects`, `slides` and `attachments` tables.
+
+    Every level of the tree has its own concurrency budget, fetched entities are
+    streamed through queues to a single database writer and to the image workers.
+
+    Slide lists are requested conditionally with the validators stored by the previous
+    run, and only slides whose payload differs from the stored one (see `payload_hash`)
+    are written back.
+    """
+
+    def __init__(
+            self, jsessionid: str = None, username: str = None, password: str = None,
+            engine: Optional[AsyncEngine] = None, method_code: int = 196, modules_concurrency: int = 2,
+            subjects_concurrency: int = 4, image_workers: int = 8, batch_size: int = 100, queue_size: int = 1000,
+            image_folder: Union[Path, str] = "images", **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.api = TestyNaprawoJazdyApi(jsessionid=jsessionid)
+        self.username = username
+        self.password = password
+        self.method_code = method_code
+
+        # the engine of the process, closed by the entrypoint after all the services stopped
+        self.engine = engine or get_engine()
+
+        self.modules_concurrency = modules_concurrency
+        self.subjects_concurrency = subjects_concurrency
+        self.image_workers = image_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+        if isinstance(image_folder, str):
+            image_folder = Path(image_folder)
+        self.image_folder = image_folder
+
+        self.validators: Dict[str, Validators] = {}
+        self.slide_hashes: Dict[int, Optional[str]] = {}
+        self.write_failed = False
+
+    async def start(self):
+        """
+        Start the synchronization of the whole course
+        """
+        async with self.api:
+            if self.username and self.password:
+                await self.api.authenticate(self.username, self.password)
+            await self.crawl()
+
+        logging.info(
+            f"Course synced: {self.api.stats.requests} requests, "
+            f"{self.api.stats.created} connections opened"
+        )
+
+    async def crawl(self):
+        """
+        Fan out over the course tree and wait until everything is stored.
+        """
+        self.image_folder.mkdir(exist_ok=True)
+        self.validators = await self.load_validators()
+        self.slide_hashes = await self.load_slide_hashes()
+        self.write_failed = False
+
+        db_queue = asyncio.Queue(maxsize=self.queue_size)
+        image_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        writer = asyncio.create_task(self.db_writer(db_queue))
+        image_tasks = [
+            asyncio.create_task(self.image_worker(image_queue))
+            for _ in range(self.image_workers)
+        ]
+
+        try:
+            modules = await self.api.get_modules()
+            for module in modules:
+                await db_queue.put(module)
+
+            modules_semaphore = asyncio.Semaphore(self.modules_concurrency)
+            subjects_semaphore = asyncio.Semaphore(self.subjects_concurrency)
+            await asyncio.gather(*[
+                self.crawl_module(module, modules_semaphore, subjects_semaphore, db_queue, image_queue)
+                for module in modules
+            ])
+        finally:
+            # the crawl tasks are finished (or cancelled with the gather) by now, so nothing
+            # is queued after the end marks and everything fetched so far gets stored
+            await db_queue.put(_DONE)
+            for _ in image_tasks:
+                await image_queue.put(_DONE)
+
+            await writer
+            await asyncio.gather(*image_tasks)
+
+    async def crawl_module(self, module: CourseModule, modules_semaphore, subjects_semaphore,
+                           db_queue: asyncio.Queue, image_queue: asyncio.Queue):
+        try:
+            async with modules_semaphore:
+                subjects = await self.api.get_subjects(module.id)
+        except Exception:
+            # the other modules are still synced, this one is retried by the next run
+            logging.exception(f"Failed to fetch the subjects of module {module.id}")
+            return
+
+        await asyncio.gather(*[
+            self.crawl_subject(subject, subjects_semaphore, db_queue, image_queue)
+            for subject in subjects
+        ])
+
+    async def crawl_subject(self, subject: SubjectModel, semaphore,
+                            db_queue: asyncio.Queue, image_queue: asyncio.Queue):
+        await db_queue.put(subject)
+
+        resource = f"slaids/{subject.id}/{self.method_code}"
+        validators = self.validators.get(resource) or Validators(resource=resource)
+
+        try:
+            async with semaphore:
+                slides = await self.api.get_slides(subject.id, self.method_code, validators=validators)
+        except Exception:
+            # the validators aren't stored, so the next run requests the slides again
+            logging.exception(f"Failed to fetch the slides of subject {subject.id}")
+            return
+
+        if slides is None:
+            logging.debug(f"Slides of subject {subject.id} are not modified")
+            # images which failed to download before are retried, the workers skip the others
+            try:
+                images = await self.load_subject_images(subject.id)
+            except Exception:
+                logging.exception(f"Failed to load the images of subject {subject.id}")
+                return
+            for file_name in images:
+                await image_queue.put(file_name)
+            return
+
+        for slide in slides:
+            # a renamed or moved slide, or one with new attachments, is stored again as well
+            if self.slide_hashes.get(slide.id) != payload_hash(slide):
+                await db_queue.put(slide)
+
+            for attachment in slide.attachements or ():
+                if is_image(attachment.get("file")):
+                    await image_queue.put(attachment["file"])
+
+        # queued after the slides, so it's stored only together with them
+        await db_queue.put(validators)
+
+    async def image_worker(self, queue: asyncio.Queue):
+        while True:
+            file_name = await queue.get()
+            if file_name is _DONE:
+                return
+
+            path = self.image_folder / file_name
+            if path.exists():
+                continue
+
+            # a failed image mustn't stop the worker, otherwise the queue fills up and the crawl hangs
+            try:
+                image = await self.api.get_image(file_name)
+
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # written aside and renamed, so a partial file is never taken for a downloaded one
+                part = path.with_name(path.name + ".part")
+                async with aiomisc.io.async_open(part, "wb") as afp:
+                    await afp.write(image)
+                part.replace(path)
+            except Exception:
+                logging.exception(f"Failed to download image {file_name}")
+
+    async def db_writer(self, queue: asyncio.Queue):
+        """
+        Drain the queue in batches of up to `batch_size` items, one transaction per batch.
+        """
+        done = False
+        while not done:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            if batch[-1] is _DONE:
+                batch.pop()
+                done = True
+
+            if not batch:
+                continue
+
+            try:
+                await self.write_batch(batch)
+            except Exception:
+                # keep draining, otherwise the producers block on a full queue,
+                # but don't store any list validators from now on
+                self.write_failed = True
+                logging.exception(f"Failed to store a batch of {len(batch)} items")
+
+    async def load_validators(self) -> Dict[str, Validators]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(select(ResourceValidator))
+            return {
+                row.resource: Validators(
+                    resource=row.resource,
+                    etag=row.etag,
+                    last_modified=row.last_modified,
+                )
+                for row in result
+            }
+
+    async def load_subject_images(self, subject_id: int) -> List[str]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(Attachment.file)
+                .join(Slide, Slide.id == Attachment.slide_id)
+                .where(Slide.subjectId == subject_id)
+            )
+            return [file_name for file_name in result.scalars() if is_image(file_name)]
+
+    async def load_slide_hashes(self) -> Dict[int, Optional[str]]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(select(Slide.id, Slide.payload_hash))
+            return dict(result.all())
+
+    async def write_batch(self, batch: List[Union[CourseModule, SubjectModel, Slaid, Validators]]):
+        # an upsert can't touch the same row twice, so the last copy of an entity wins
+        modules = list({item.id: item for item in batch if isinstance(item, CourseModule)}.values())
+        subjects = list({item.id: item for item in batch if isinstance(item, SubjectModel)}.values())
+        slides = list({item.id: item for item in batch if isinstance(item, Slaid)}.values())
+        validators = [
+            dict(resource=item.resource, etag=item.etag, last_modified=item.last_modified)
+            for item in {item.resource: item for item in batch if isinstance(item, Validators)}.values()
+        ] if not self.write_failed else []
+        changed_ids: List[int] = []
+
+        async with self.engine.begin() as conn:
+            if modules or subjects or slides:
+                # the bot drops its cached course once this transaction commits
+                await notify_course_changed(conn)
+
+            if modules:
+                stmt = insert(Module).values([
+                    dict(
+                        id=module.id,
+                        moduleNumber=module.moduleNumber,
+                        name=module.name,
+                        subjectsNumber=module.subjectsNumber,
+                    )
+                    for module in modules
+                ])
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[Module.id],
+                    set_=dict(
+                        moduleNumber=stmt.excluded.moduleNumber,
+                        name=stmt.excluded.name,
+                        subjectsNumber=stmt.excluded.subjectsNumber,
+                    ),
+                ))
+
+            if subjects:
+                stmt = insert(Subject).values([
+                    dict(id=subject.id, name=subject.name)
+                    for subject in subjects
+                ])
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[Subject.id],
+                    set_=dict(name=stmt.excluded.name),
+                ))
+
+            if slides:
+                slide_ids = [slide.id for slide in slides]
+                # RETURNING only sees the new rows, so the stored contents are read (and locked) first
+                result = await conn.execute(
+                    select(Slide.id, Slide.content).where(Slide.id.in_(slide_ids)).with_for_update()
+                )
+                stored = dict(result.all())
+                changed_ids = [
+                    slide.id for slide in slides
+                    if slide.id not in stored or stored[slide.id] != slide.content
+                ]
+
+                stmt = insert(Slide).values([
+                    dict(
+                        id=slide.id,
+                        subjectId=slide.subjectId,
+                        lessonNumber=slide.lessonNumber,
+                        name=slide.name,
+                        content=slide.content,
+                        content_hash=content_hash(slide.content),
+                        payload_hash=payload_hash(slide),
+                        module_id=slide.courseModuleId,
+                    )
+                    for slide in slides
+                ])
+                content_changed = Slide.content.is_distinct_from(stmt.excluded.content)
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[Slide.id],
+                    set_=dict(
+                        subjectId=stmt.excluded.subjectId,
+                        lessonNumber=stmt.excluded.lessonNumber,
+                        name=stmt.excluded.name,
+                        content=stmt.excluded.content,
+                        content_hash=stmt.excluded.content_hash,
+                        payload_hash=stmt.excluded.payload_hash,
+                        module_id=stmt.excluded.module_id,
+                        # only a changed content has to be formatted and dubbed again
+                        formatted_content=case((content_changed, None), else_=Slide.formatted_content),
+                        processed_version=case((content_changed, None), else_=Slide.processed_version),
+                    ),
+                ))
+
+                # attachments have no natural key, so those of a slide are replaced as a whole
+                # when they differ, keeping the telegram file ids of the unchanged ones
+                result = await conn.execute(
+                    select(Attachment.slide_id, *ATTACHMENT_COLUMNS)
+                    .where(Attachment.slide_id.in_(slide_ids))
+                    .order_by(Attachment.id)
+                )
+                stored_attachments = defaultdict(list)
+                for slide_id, *attachment in result:
+                    stored_attachments[slide_id].append(tuple(attachment))
+                replaced_ids = [
+                    slide.id for slide in slides
+                    if attachment_rows(slide) != stored_attachments.get(slide.id, [])
+                ]
+                if replaced_ids:
+                    await conn.execute(delete(Attachment).where(Attachment.slide_id.in_(replaced_ids)))
+                    attachments = [
+                        dict(zip((column.key for column in ATTACHMENT_COLUMNS), attachment), slide_id=slide.id)
+                        for slide in slides if slide.id in replaced_ids
+                        for attachment in attachment_rows(slide)
+                    ]
+                    if attachments:
+                        await conn.execute(insert(Attachment).values(attachments))
+
+            if changed_ids:
+                await conn.execute(delete(AudioDubbing).where(AudioDubbing.slide_id.in_(changed_ids)))
+                # the new content gets a fresh set of synthesis attempts
+                await conn.execute(delete(SynthesisFailure).where(SynthesisFailure.slide_id.in_(changed_ids)))
+
+            if validators:
+                stmt = insert(ResourceValidator).values(validators)
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[ResourceValidator.resource],
+                    set_=dict(etag=stmt.excluded.etag, last_modified=stmt.excluded.last_modified),
+                ))
+
+        logging.debug(f"Stored {len(modules)} modules, {len(subjects)} subjects, {len(slides)} slides")
+
+    async def stop(self, exception: Exception = None) -> Any:
+        await self.api.close()
+
+
+def attachment_rows(slide: Slaid) -> List[tuple]:
+    return [
+        tuple(attachment.get(column.key) for column in ATTACHMENT_COLUMNS)
+        for attachment in slide.attachements or ()
+    ]
+
+
+def payload_hash(slide: Slaid) -> str:
+    """
+    Hash everything of the slide the crawler stores.
+    """
+    payload = json.dumps(
+        [slide.name, slide.lessonNumber, slide.subjectId, slide.courseModuleId, slide.content,
+         attachment_rows(slide)],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def is_image(file_name: str) -> bool:
+    if not file_name:
+        return False
+    mime_type, _ = mimetypes.guess_type(file_name)
+    return bool(mime_type and mime_type.startswith("image/"))
@@ -1,16 +1,46 @@
 import logging
 import typing
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import List, Optional
 
 import aiohttp
 
-from models.request import CourseModule, User, Subject, Slaid, ErrorResponse
+from api.utils.throttling import Throttler
+from models.request import CourseModule, User, Subject, Slaid, ErrorResponse, Validators
+
+
+@dataclass
+class ConnectionStats:
+    """
+    Counters of the TCP connections handed out by the client connector.
+
+    `created` grows on every new TCP (+TLS) handshake, `reused` on every request
+    served by an already opened keep-alive connection.
+    """
+    created: int = 0
+    reused: int = 0
+    requests: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.created + self.reused
+        return self.reused / total if total else 0.0
 
 
 @dataclass
 class TestyNaprawoJazdyApi:
     jsessionid: str = None
+
+    # connector settings, see `aiohttp.TCPConnector`
+    limit: int = 100
+    limit_per_host: int = 10
+    ttl_dns_cache: Optional[int] = 300
+    keepalive_timeout: float = 30
+
+    stats: ConnectionStats = field(default_factory=ConnectionStats)
+    throttler: Throttler = field(default_factory=Throttler)
+
     headers = {
         'Accept': 'application/json, text/plain, */*',
         'Referer': 'https://www.testynaprawojazdy.eu/',
@@ -22,96 +52,212 @@ class TestyNaprawoJazdyApi:
 
     def __post_init__(self):
         self.headers.update(jsessionid=self.jsessionid) if self.jsessionid else None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "TestyNaprawoJazdyApi":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def open(self) -> aiohttp.ClientSession:
+        """
+        Open the shared client session used by every request of this client.
+
+        Returns:
+            aiohttp.ClientSession: The long-lived session.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                use_dns_cache=self.ttl_dns_cache is not None,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Close the shared client session and all of its keep-alive connections.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logging.debug(
+                "Closed session: %d connections created, %d reused",
+                self.stats.created, self.stats.reused,
+            )
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError(
+                "Session is not opened, use `async with TestyNaprawoJazdyApi()` or call `open()` first"
+            )
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        async def on_request_start(session, context: SimpleNamespace, params):
+            self.stats.requests += 1
+
+        async def on_connection_create_end(session, context: SimpleNamespace, params):
+            self.stats.created += 1
+
+        async def on_connection_reuseconn(session, context: SimpleNamespace, params):
+            self.stats.reused += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def conditional_headers(self, validators: Validators = None) -> dict:
+        """
+        Build request headers, adding the conditional ones if validators are known.
+
+        Args:
+            validators (Validators): Validators stored by the previous sync, if any.
+
+        Returns:
+            dict: Headers for the request.
+        """
+        headers = dict(self.headers)
+        if validators is not None:
+            if validators.etag:
+                headers['If-None-Match'] = validators.etag
+            if validators.last_modified:
+                headers['If-Modified-Since'] = validators.last_modified
+        return headers
+
+    @staticmethod
+    def update_validators(validators: Optional[Validators], response: aiohttp.ClientResponse) -> bool:
+        """
+        Refresh the validators from the response headers.
+
+        Returns:
+            bool: False if the resource wasn't modified (304), True otherwise.
+        """
+        if validators is None:
+            return True
+        if response.status == 304:
+            return False
+
+        validators.etag = response.headers.get('ETag')
+        validators.last_modified = response.headers.get('Last-Modified')
+        return True
 
     async def authenticate(self, username: str, password: str) -> User:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            auth_data = {
-                'userName': username,
-                'password': password
-            }
-            async with session.post(
-                    'https://api.testynaprawojazdy.eu/eprawko-rest/login/',
-                    headers=self.headers,
-                    data=auth_data,
-            ) as response:
-                response = await response.json()
-                if not response:
-                    raise Exception('Authentication failed')
-
-                logging.debug("Authentication response: %s", response)
-                model_data = User(**response)
-                self.jsessionid = model_data.uuid
-                self.headers.update(jsessionid=self.jsessionid)
-                return model_data
+        auth_data = {
+            'userName': username,
+            'password': password
+        }
+        async with self.throttler.request(
+                self.session, 'POST',
+                'https://api.testynaprawojazdy.eu/eprawko-rest/login/',
+                endpoint='login',
+                headers=self.headers,
+                data=auth_data,
+        ) as response:
+            response = await response.json()
+            if not response:
+                raise Exception('Authentication failed')
+
+            logging.debug("Authentication response: %s", response)
+            model_data = User(**response)
+            self.jsessionid = model_data.uuid
+            self.headers.update(jsessionid=self.jsessionid)
+            return model_data
 
     async def get_modules(self) -> List[CourseModule]:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(
-                    f'{self.base_url}'
-                    f'modules/196',
-                    headers=self.headers,
-            ) as response:
-                courses_data = await response.json()
-
-                return [
-                    CourseModule(
-                        id=course['id'],
-                        moduleNumber=course['moduleNumber'],
-                        name=course['name'],
-                        subjectsNumber=course['subjectsNumber'],
-                    )
-                    for course in courses_data
-                ]
+        async with self.throttler.request(
+                self.session, 'GET',
+                f'{self.base_url}'
+                f'modules/196',
+                endpoint='course',
+                headers=self.headers,
+        ) as response:
+            courses_data = await response.json()
+
+            return [
+                CourseModule(
+                    id=course['id'],
+                    moduleNumber=course['moduleNumber'],
+                    name=course['name'],
+                    subjectsNumber=course['subjectsNumber'],
+                )
+                for course in courses_data
+            ]
 
     async def get_subjects(self, module_id: int) -> List[Subject]:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(
-                    f'{self.base_url}'
-                    f'subjects/{module_id}',
-                    headers=self.headers,
-            ) as response:
-                subjects_data = await response.json()
-
-                return [
-                    Subject(
-                        id=subject['id'],
-                        name=subject['name'],
-                        slaidsNumber=subject['slaidsNumber']
-                    )
-                    for subject in subjects_data
-                ]
-
-    async def get_slides(self, subject_id: int, method_code=196) -> List[Slaid]:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(
-                    f'{self.base_url}'
-                    f'slaids/{subject_id}/{method_code}',
-                    headers=self.headers,
-            ) as response:
-                slides_data = await response.json()
-
-                return [
-                    Slaid(**slide)
-                    for slide in slides_data
-                ]
-
-    async def get_slide(self, subject_id: int, slide_id: int) -> typing.Union[Slaid, ErrorResponse]:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(
-                    f'{self.base_url}'
-                    f'slaid/{subject_id}/{slide_id}',
-                    headers=self.headers,
-            ) as response:
-                slide_data = await response.json()
-                if slide_data.get("error"):
-                    return ErrorResponse(**slide_data)
-
-                return Slaid(**slide_data)
+        async with self.throttler.request(
+                self.session, 'GET',
+                f'{self.base_url}'
+                f'subjects/{module_id}',
+                endpoint='course',
+                headers=self.headers,
+        ) as response:
+            subjects_data = await response.json()
+
+            return [
+                Subject(
+                    id=subject['id'],
+                    name=subject['name'],
+                    slaidsNumber=subject['slaidsNumber']
+                )
+                for subject in subjects_data
+            ]
+
+    async def get_slides(
+            self, subject_id: int, method_code=196, validators: Validators = None
+    ) -> Optional[List[Slaid]]:
+        async with self.throttler.request(
+                self.session, 'GET',
+                f'{self.base_url}'
+                f'slaids/{subject_id}/{method_code}',
+                endpoint='course',
+                headers=self.conditional_headers(validators),
+        ) as response:
+            if not self.update_validators(validators, response):
+                return None
+            slides_data = await response.json()
+
+            return [
+                Slaid(**slide)
+                for slide in slides_data
+            ]
+
+    async def get_slide(
+            self, subject_id: int, slide_id: int, validators: Validators = None
+    ) -> typing.Union[Slaid, ErrorResponse, None]:
+        async with self.throttler.request(
+                self.session, 'GET',
+                f'{self.base_url}'
+                f'slaid/{subject_id}/{slide_id}',
+                endpoint='course',
+                headers=self.conditional_headers(validators),
+        ) as response:
+            if not self.update_validators(validators, response):
+                return None
+            slide_data = await response.json()
+            if slide_data.get("error"):
+                return ErrorResponse(**slide_data)
+
+            return Slaid(**slide_data)
 
     async def get_image(self, image_url: str) -> bytes:
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(
-                    self.image_url + image_url,
-                    headers=self.headers,
-            ) as response:
-                return await response.read()
\ No newline at end of file
+        async with self.throttler.request(
+                self.session, 'GET',
+                self.image_url + image_url,
+                endpoint='images',
+                headers=self.headers,
+        ) as response:
+            # an error page mustn't be stored as the image
+            response.raise_for_status()
+            return await response.read()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from api.utils.single_flight import SingleFlight
+from database.models import AudioCacheEntry
+
+
+class AudioCache:
+    """
+    Content-addressed store of synthesized audio.
+
+    Blobs are kept under `root` as `<key[:2]>/<key>.mp3`, where the key is a hash of
+    everything that affects the synthesis result. The `audio_cache` table indexes
+    them with their size and last use, the least recently used blobs are evicted
+    once the store grows over `max_size` bytes.
+    """
+
+    def __init__(self, engine: AsyncEngine, root: Union[Path, str], max_size: Optional[int] = None):
+        self.engine = engine
+        self.root = Path(root)
+        self.max_size = max_size
+        self._pending = SingleFlight()
+
+    @staticmethod
+    def key(text: str, voice_id: str, stability: float = 0, similarity_boost: float = 0,
+            model_id: Optional[str] = None) -> str:
+        payload = json.dumps(
+            [text, voice_id, stability, similarity_boost, model_id],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def blob_path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.mp3"
+
+    async def get(self, key: str) -> Optional[Path]:
+        """
+        Look the audio up in the cache and mark it as recently used.
+
+        Args:
+            key (str): The cache key, see `AudioCache.key`.
+
+        Returns:
+            Path: Path of the cached blob, None on a cache miss.
+        """
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                update(AudioCacheEntry)
+                .where(AudioCacheEntry.key == key)
+                .values(hits=AudioCacheEntry.hits + 1, last_used_at=datetime.utcnow())
+                .returning(AudioCacheEntry.path)
+            )
+            path = result.scalar()
+
+        if path is None:
+            return None
+
+        path = self.root / path
+        if not path.exists():
+            # the blob was removed behind our back, forget about it
+            await self.forget(key)
+            return None
+        return path
+
+    async def index(self, key: str, path: Path) -> None:
+        """
+        Add a blob already placed at `blob_path(key)` to the index and evict old entries.
+        """
+        now = datetime.utcnow()
+        async with self.engine.begin() as conn:
+            stmt = insert(AudioCacheEntry).values(
+                key=key,
+                path=str(path.relative_to(self.root)),
+                size=path.stat().st_size,
+                hits=0,
+                created_at=now,
+                last_used_at=now,
+            )
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=[AudioCacheEntry.key],
+                set_=dict(size=stmt.excluded.size, last_used_at=stmt.excluded.last_used_at),
+            ))
+
+        await self.evict()
+
+    async def get_or_create(self, key: str, create: Callable[[Path], Awaitable[bool]]) -> Optional[Path]:
+        """
+        Get the audio from the cache, creating it with `create` on a miss.
+
+        Concurrent calls with the same key share one lookup and `create` call,
+        an exception raised by `create` is raised to all of them.
+
+        Args:
+            key (str): The cache key, see `AudioCache.key`.
+            create (callable): Coroutine function writing the audio to the given path
+                (atomically), returning False if it failed.
+
+        Returns:
+            Path: Path of the cached blob, None if the audio couldn't be created.
+        """
+        return await self._pending.run(key, lambda: self._get_or_create(key, create))
+
+    async def _get_or_create(self, key: str, create: Callable[[Path], Awaitable[bool]]) -> Optional[Path]:
+        path = await self.get(key)
+        if path is not None:
+            return path
+
+        blob_path = self.blob_path(key)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if not await create(blob_path):
+            return None
+        await self.index(key, blob_path)
+        return blob_path
+
+    async def evict(self) -> None:
+        """
+        Remove the least recently used blobs until the store fits into `max_size`.
+        """
+        if self.max_size is None:
+            return
+
+        async with self.engine.begin() as conn:
+            total = await conn.scalar(select(func.coalesce(func.sum(AudioCacheEntry.size), 0)))
+            if total <= self.max_size:
+                return
+
+            result = await conn.execute(
+                select(AudioCacheEntry.key, AudioCacheEntry.path, AudioCacheEntry.size)
+                .order_by(AudioCacheEntry.last_used_at)
+            )
+            evicted = []
+            for key, path, size in result:
+                if total <= self.max_size:
+                    break
+                evicted.append(key)
+                total -= size
+                # hardlinks made from the blob keep their data
+                (self.root / path).unlink(missing_ok=True)
+
+            await conn.execute(delete(AudioCacheEntry).where(AudioCacheEntry.key.in_(evicted)))
+
+        logging.info(f"Evicted {len(evicted)} blobs from the audio cache")
+
+    async def forget(self, key: str) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(AudioCacheEntry).where(AudioCacheEntry.key == key))
+
+
+def link_audio(source: Path, target: Path) -> None:
+    """
+    Place the cached audio at `target` as a hardlink, or a copy if linking isn't possible.
+    """
+    temp_target = target.with_suffix(".part")
+    temp_target.unlink(missing_ok=True)
+    try:
+        os.link(source, temp_target)
+    except OSError:
+        shutil.copyfile(source, temp_target)
+    os.replace(temp_target, target)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.models import AudioDubbing, SynthesisFailure
+
+
+@dataclass
+class SynthesisResult:
+    slide_id: int
+    filename: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ResultCollector:
+    """
+    Collects synthesis results and stores them in batches.
+
+    Successful syntheses become `AudioDubbing` rows (one multi-row insert per batch),
+    failed ones are counted in `synthesis_failures` to be retried by the next run.
+    A batch is flushed every `batch_size` results or `flush_interval` seconds after
+    its first result, whichever comes first.
+    """
+
+    def __init__(self, engine: AsyncEngine, batch_size: int = 100, flush_interval: float = 0.5):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "ResultCollector":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def success(self, slide_id: int, filename: str) -> None:
+        await self._queue.put(SynthesisResult(slide_id, filename=filename))
+
+    async def failure(self, slide_id: int, error: str) -> None:
+        await self._queue.put(SynthesisResult(slide_id, error=error))
+
+    async def close(self) -> None:
+        """
+        Flush the collected results and stop.
+        """
+        if self._task is None:
+            return
+
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        closed = False
+        while not closed:
+            result = await self._queue.get()
+            if result is None:
+                return
+
+            batch = [result]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    result = await asyncio.wait_for(self._queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                if result is None:
+                    closed = True
+                    break
+                batch.append(result)
+
+            try:
+                await self.flush(batch)
+            except Exception:
+                logging.exception(f"Failed to store {len(batch)} synthesis results")
+
+    async def flush(self, batch: List[SynthesisResult]) -> None:
+        succeeded = [result for result in batch if result.error is None]
+        # a failure row can be touched only once per statement
+        failed = list({result.slide_id: result for result in batch if result.error is not None}.values())
+
+        async with self.engine.begin() as conn:
+            if succeeded:
+                # the bot may have dubbed some of the slides on demand meanwhile
+                await conn.execute(insert(AudioDubbing).values([
+                    dict(slide_id=result.slide_id, audio=result.filename)
+                    for result in succeeded
+                ]).on_conflict_do_nothing(index_elements=[AudioDubbing.slide_id]))
+                await conn.execute(delete(SynthesisFailure).where(
+                    SynthesisFailure.slide_id.in_([result.slide_id for result in succeeded])
+                ))
+
+            if failed:
+                now = datetime.utcnow()
+                stmt = insert(SynthesisFailure).values([
+                    dict(slide_id=result.slide_id, attempts=1, error=result.error, failed_at=now)
+                    for result in failed
+                ])
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[SynthesisFailure.slide_id],
+                    set_=dict(
+                        attempts=SynthesisFailure.attempts + 1,
+                        error=stmt.excluded.error,
+                        failed_at=stmt.excluded.failed_at,
+                    ),
+                ))
+
+        logging.info(f"Stored {len(succeeded)} audio dubbings, {len(failed)} failures")
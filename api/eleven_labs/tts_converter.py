@@ -1,119 +1,237 @@
 import asyncio
 import logging
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Union, Any
+from typing import Optional, Union, Any
 
 import aiomisc
-from sqlalchemy import MetaData, select
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from redis import asyncio as aioredis
+from sqlalchemy import MetaData, select, or_, func
+from sqlalchemy.ext.asyncio import AsyncEngine
 
+from api.eleven_labs.audio_cache import AudioCache, link_audio
 from api.eleven_labs.response_models import ErrorResponse
-from api.eleven_labs.voice_synth import TextToSpeech, save_audio
-from database.models import Slide, AudioDubbing
+from api.eleven_labs.result_collector import ResultCollector
+from api.eleven_labs.voice_cache import voice_catalogue
+from api.eleven_labs.voice_synth import TextToSpeech
+from api.utils.throttling import Throttler, AIMDLimiter
+from database.engine import get_engine
+from database.notify import notify_course_changed
+from database.models import Slide, AudioDubbing, SynthesisFailure
+
+
+class SynthesisError(Exception):
+    pass
+
+
+@dataclass
+class PipelineStats:
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return (self.done + self.failed) / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        if not self.throughput:
+            return None
+        return (self.total - self.done - self.failed) / self.throughput
 
 
 class TTSConverter(aiomisc.Service):
     def __init__(
-            self, api_key: str, voice: str = "Antoni", pguser: str = None, pgpass: str = None,
-            host: str = None, database: str = None,
-            meta=MetaData, echo: bool = False, save_folder: Union[Path, str] = "files", **kwargs: Any
+            self, api_key: str, voice: str = "Antoni", engine: Optional[AsyncEngine] = None,
+            meta=MetaData, save_folder: Union[Path, str] = "files",
+            requests_per_second: float = 5, max_concurrency: int = 10, redis_url: str = None,
+            audio_cache_size: Optional[int] = None, max_attempts: int = 3,
+            batch_size: int = 100, flush_interval: float = 0.5, workers: int = None,
+            prefetch: int = 500, report_interval: float = 30, **kwargs: Any
     ):
         super().__init__(**kwargs)
         self.meta = meta
 
-        # create an engine that connects to the PostgreSQL database
-        self.engine = create_async_engine(
-            "postgresql+asyncpg://"
-            f"{pguser}:{pgpass}@{host}"
-            f"/{database}",
-            echo=echo,
-        )
+        # the engine of the process, closed by the entrypoint after all the services stopped
+        self.engine = engine or get_engine()
 
         # set the save location for the audio files
         if isinstance(save_folder, str):
             save_folder = Path(save_folder)
         self.save_location = save_folder
 
+        # identical texts are synthesized once and linked from the cache
+        self.audio_cache = AudioCache(self.engine, self.save_location / "cache", max_size=audio_cache_size)
+
+        # results are stored in batches, failed slides are retried up to `max_attempts` runs
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # pipeline settings, there is no use in more workers than allowed concurrent requests
+        self.workers = workers or max_concurrency
+        self.prefetch = prefetch
+        self.report_interval = report_interval
+        self.stats = PipelineStats()
+        self.task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
         # set the API key and voice to be used
         self.api_key = api_key
         self.voice = voice
 
+        # one request budget for all the synthesis tasks, the concurrency grows
+        # up to `max_concurrency` until ElevenLabs starts throttling
+        self.throttler = Throttler(
+            rate=requests_per_second,
+            concurrency=AIMDLimiter(maximum=max_concurrency),
+        )
+        self.tts = TextToSpeech(self.api_key, throttler=self.throttler)
+
+        # share the voice catalogue with the other processes through Redis
+        if redis_url:
+            voice_catalogue.redis = aioredis.from_url(redis_url)
+
+    def audioless_slides_query(self):
+        """
+        Build the query of slides to dub
+
+        Returns:
+            Select: Slides with formatted content but without audio dubbing,
+                which haven't failed too many times already, in id order
+        """
+        return (
+            select(Slide.id, Slide.formatted_content)
+            .outerjoin(AudioDubbing, Slide.id == AudioDubbing.slide_id)
+            .outerjoin(SynthesisFailure, Slide.id == SynthesisFailure.slide_id)
+            .where(AudioDubbing.id == None)
+            .where(Slide.formatted_content != None, Slide.formatted_content != "")
+            .where(or_(SynthesisFailure.attempts == None, SynthesisFailure.attempts < self.max_attempts))
+            .order_by(Slide.id)
+        )
+
     async def get_audioless_slides(self):
         """
         Get slides without audio dubbing
 
         Returns:
-            list: List of `Slide` objects without audio dubbing
+            list: List of `(id, formatted_content)` rows of slides without audio dubbing
         """
         async with self.engine.connect() as conn:
-            # retrieve all `Slide` objects that have not been dubbed with audio
-                stmt = (
-                    select(Slide)
-                    .outerjoin(AudioDubbing, Slide.id == AudioDubbing.slide_id)
-                    .where(AudioDubbing.id == None)
-                )
-                result = await conn.execute(stmt)
-                slides_without_audio = result.all()
-                return slides_without_audio
+            result = await conn.execute(self.audioless_slides_query())
+            return result.all()
 
     def create_save_folder(self):
         """
         Create the save folder for the audio files
         """
-        current_folder = Path(__file__).parent
-        save_location = current_folder / self.save_location
-        save_location.mkdir(exist_ok=True)
+        # the bot reads the files from the same folder, see `settings.audio_path`
+        self.save_location.mkdir(parents=True, exist_ok=True)
 
     async def start(self):
         """
         Start the TTS conversion process for slides without audio dubbing
         """
-        # retrieve all `Slide` objects without audio dubbing
-        slides_without_audio = await self.get_audioless_slides()
+        # open the HTTP session and resolve the voice once for the whole run
+        await self.tts.open()
+        await self.tts.set_voice(voice_name=self.voice)
+        if not self.tts.voice_id:
+            logging.error(f"Voice {self.voice} not found")
+            return
+
         # create the save folder for the audio files
         self.create_save_folder()
 
-        tasks = []
-        # create a semaphore to limit the number of concurrent tasks
-        semaphore = asyncio.Semaphore(10)  # Adjust the number according to your system capabilities
-        for slide in slides_without_audio:
-            slide: Slide
-            filename = f"{slide.id}.mp3"
+        # the pipeline runs in background, so `stop()` can interrupt it
+        self._stopping.clear()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """
+        Run the pipeline: a streaming cursor feeds a bounded queue, consumed by `workers`
+        workers which synthesize, save and report every slide. Memory use doesn't depend
+        on the backlog size, and since only finished slides are recorded, a crashed run is
+        resumed by the next one.
+        """
+        async with self.engine.connect() as conn:
+            total = await conn.scalar(select(func.count()).select_from(self.audioless_slides_query().subquery()))
+        self.stats = PipelineStats(total=total)
+        logging.info(f"Dubbing {total} slides with {self.workers} workers")
+
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        async with ResultCollector(self.engine, self.batch_size, self.flush_interval) as collector:
+            reporter = asyncio.create_task(self.report_progress())
+            workers = [
+                asyncio.create_task(self.worker(queue, collector))
+                for _ in range(self.workers)
+            ]
+            try:
+                await self.produce(queue)
+            finally:
+                if self._stopping.is_set():
+                    # drop what wasn't started yet, the next run picks it up
+                    while not queue.empty():
+                        queue.get_nowait()
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                reporter.cancel()
+
+        if self.stats.done:
+            async with self.engine.begin() as conn:
+                await notify_course_changed(conn)
+        self.log_progress()
 
-            # skip slides without formatted content
-            if not slide.formatted_content:
-                continue
+    async def produce(self, queue: asyncio.Queue):
+        async with self.engine.connect() as conn:
+            result = await conn.stream(self.audioless_slides_query().execution_options(yield_per=self.prefetch))
+            async for slide in result:
+                if self._stopping.is_set():
+                    break
+                await queue.put(slide)
+
+    async def worker(self, queue: asyncio.Queue, collector: ResultCollector):
+        while True:
+            slide = await queue.get()
+            if slide is None:
+                return
+            await self.process_slide(slide, collector)
 
-            # add the TTS conversion task to the list of tasks to be executed
-            tasks.append(self.process_single_text(slide.formatted_content, filename, semaphore))
-            # create a new database session and add a reference to the saved audio file
-            async_session = async_sessionmaker(self.engine, expire_on_commit=False)
-            async with async_session() as session:
-                async with session.begin():
-                    session.add(AudioDubbing(
-                        slide_id=slide.id,
-                        audio=filename,
-                    ))
+    async def report_progress(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.log_progress()
 
-        # execute all TTS conversion tasks concurrently
-        await asyncio.gather(*tasks)
+    def log_progress(self):
+        stats = self.stats
+        eta = f"{stats.eta / 60:.1f}m" if stats.eta is not None else "unknown"
+        logging.info(
+            f"Dubbed {stats.done}/{stats.total} slides ({stats.failed} failed), "
+            f"{stats.throughput:.2f} slides/s, ETA {eta}"
+        )
 
-    async def process_single_text(self, text_content, filename, semaphore):
+    async def process_slide(self, slide, collector: ResultCollector):
         """
-        Process a single slide's formatted content and save the resulting audio file
+        Dub a single slide and report the result to the collector
 
         Args:
-            text_content (str): The formatted content of the slide
-            filename (str): The filename to save the audio as
-            semaphore (asyncio.Semaphore): A semaphore to limit the number of concurrent tasks
-
-        :param text_content:
-        :param filename:
-        :param semaphore:
-        :return:
+            slide: The `(id, formatted_content)` row of the slide to dub
+            collector (ResultCollector): Where to report the result
         """
-        async with semaphore:
-            await self.voice_process(text_content, filename)
+        filename = f"{slide.id}.mp3"
+        try:
+            await self.voice_process(slide.formatted_content, filename)
+        except Exception as e:
+            logging.exception(f"Failed to dub slide {slide.id}")
+            self.stats.failed += 1
+            await collector.failure(slide.id, str(e) or repr(e))
+        else:
+            self.stats.done += 1
+            await collector.success(slide.id, filename)
 
     async def voice_process(self, text: str, filename: str):
         """
@@ -122,27 +240,46 @@ class TTSConverter(aiomisc.Service):
         Args:
             text (str): The text to be converted to speech
             filename (str): The filename to save the audio as
+
+        Raises:
+            SynthesisError: If the audio couldn't be synthesized
         """
-        # create a new TextToSpeech object using the API key and selected voice
-        tts = TextToSpeech(self.api_key)
-        await tts.set_voice(voice_name=self.voice)
+        # take the audio from the cache, synthesizing it on a miss
+        key = self.audio_cache.key(text, self.tts.voice_id)
+        cached_audio = await self.audio_cache.get_or_create(key, lambda path: self.synthesize(text, path))
+        if cached_audio is None:
+            raise SynthesisError("The audio couldn't be synthesized")
 
-        # synthesize speech for the given text
-        speech_response = await tts.synthesize_speech(text)
-        if isinstance(speech_response, ErrorResponse):
-            # log any errors that occur during the TTS conversion
-            logging.error("Error while synthesizing speech:")
-            for error in speech_response.get_errors():
-                logging.error(f"{error['msg']} (Type: {error['type']})")
+        # place the resulting audio file
+        link_audio(cached_audio, self.save_location / filename)
+        logging.info(f"Saved audio to {self.save_location / filename}")
 
-            return
+    async def synthesize(self, text: str, path: Path) -> bool:
+        """
+        Synthesize speech for the given text, streaming the audio to `path`
 
-        # save the resulting audio file
-        await save_audio(
-            speech_response,
-            (self.save_location / filename)
-        )
-        logging.info(f"Saved audio to {self.save_location / filename}")
+        Args:
+            text (str): The text to be converted to speech
+            path (Path): Where to save the audio
+
+        Returns:
+            bool: Always True, failures are raised
+
+        Raises:
+            SynthesisError: If the API returned an error
+        """
+        speech_response = await self.tts.synthesize_speech_to_file(text, path)
+        if isinstance(speech_response, ErrorResponse):
+            raise SynthesisError(f"{speech_response.status_code}: {speech_response.get_errors()}")
+
+        return True
 
     async def stop(self, exception: Exception = None) -> Any:
-        await self.engine.dispose()
+        # let the workers finish the slides in progress and flush the results
+        self._stopping.set()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+        await self.tts.close()
+        if voice_catalogue.redis is not None:
+            await voice_catalogue.redis.close()
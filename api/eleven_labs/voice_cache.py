@@ -0,0 +1,82 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from redis import asyncio as aioredis
+
+from api.eleven_labs.response_models import ErrorResponse
+
+
+class VoiceCatalogue:
+    """
+    Process-wide cache of the ElevenLabs voice catalogue (voice name -> voice_id).
+
+    The catalogue is kept in memory for `ttl` seconds and, when a Redis client is
+    given, shared between processes under `prefix`, so `GET /voices` is requested
+    once per TTL instead of before every synthesis.
+    """
+
+    def __init__(self, ttl: int = 3600, redis: Optional[aioredis.Redis] = None, prefix: str = "e11:voices"):
+        self.ttl = ttl
+        self.redis = redis
+        self.prefix = prefix
+        self._voices: Dict[str, Tuple[float, Dict[str, str]]] = {}
+
+    def _key(self, api_key: str) -> str:
+        # voices differ between accounts, but the key itself shouldn't leak into Redis
+        return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    async def get(self, tts) -> Optional[Dict[str, str]]:
+        """
+        Get the voice catalogue of the account of `tts`, loading it on a cache miss.
+
+        Args:
+            tts (TextToSpeech): The client used to load the catalogue.
+
+        Returns:
+            dict: Mapping of voice names to voice ids, None if the API call failed.
+        """
+        key = self._key(tts.api_key)
+
+        cached = self._voices.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        voices = await self._get_shared(key)
+        if voices is None:
+            response = await tts.get_voices()
+            if isinstance(response, ErrorResponse):
+                logging.error(f"Error while loading voices: {response.get_errors()}")
+                return None
+
+            voices = {voice.name: voice.voice_id for voice in response.get_voices()}
+            await self._set_shared(key, voices)
+
+        self._voices[key] = (time.monotonic() + self.ttl, voices)
+        return voices
+
+    async def _get_shared(self, key: str) -> Optional[Dict[str, str]]:
+        if self.redis is None:
+            return None
+        try:
+            data = await self.redis.get(f"{self.prefix}:{key}")
+        except aioredis.RedisError:
+            logging.exception("Failed to read the voice catalogue from Redis")
+            return None
+        return json.loads(data) if data else None
+
+    async def _set_shared(self, key: str, voices: Dict[str, str]) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"{self.prefix}:{key}", json.dumps(voices), ex=self.ttl)
+        except aioredis.RedisError:
+            logging.exception("Failed to store the voice catalogue in Redis")
+
+    def invalidate(self) -> None:
+        self._voices.clear()
+
+
+voice_catalogue = VoiceCatalogue()
@@ -1,6 +1,6 @@
-import tempfile
+import os
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 import aiohttp
 import asyncio
@@ -9,61 +9,98 @@ import json
 import aiomisc
 
 from api.eleven_labs.response_models import VoicesResponse, ErrorResponse, Voice
+from api.eleven_labs.voice_cache import VoiceCatalogue, voice_catalogue
+from api.utils.throttling import Throttler
 
 API_BASE_URL = "https://api.elevenlabs.io/v1"
 
 
-async def save_audio(audio_data, filename: Union[str, Path]):
-    with tempfile.TemporaryDirectory():
-        afp: aiomisc.io.AsyncTextIO
+CHUNK_SIZE = 64 * 1024
 
-        async with aiomisc.io.async_open(filename, 'wb') as afp:
-            await afp.write(audio_data)
-            await afp.seek(0)
+
+async def save_audio_stream(response: aiohttp.ClientResponse, filename: Union[str, Path],
+                            chunk_size: int = CHUNK_SIZE):
+    """
+    Write the response body to `filename` chunk by chunk.
+
+    The data goes to a temporary file next to the target first and is renamed into
+    place at the end, so a broken download never leaves a truncated file behind.
+    """
+    filename = Path(filename)
+    temp_filename = filename.with_name(filename.name + ".part")
+    afp: aiomisc.io.AsyncBinaryIO
+
+    try:
+        async with aiomisc.io.async_open(temp_filename, 'wb') as afp:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await afp.write(chunk)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        temp_filename.unlink(missing_ok=True)
+        raise
 
 
 class TextToSpeech:
-    def __init__(self, api_key):
+    def __init__(self, api_key, throttler: Throttler = None, catalogue: VoiceCatalogue = None):
         self.api_key = api_key
+        # share one throttler between instances to keep a common request budget
+        self.throttler = throttler or Throttler(rate=5)
+        self.catalogue = catalogue or voice_catalogue
         self.voice_id = None
         self.voice_name = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "TextToSpeech":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def open(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers={"xi-api-key": self.api_key})
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Session is not opened, use `async with TextToSpeech()` or call `open()` first")
+        return self._session
 
     async def set_voice(self, voice_name: str = None, voice_id: str = None):
         if not voice_name and not voice_id:
             raise ValueError("Either voice_name or voice_id must be provided")
 
-        response = await self.get_voices()
-
-        if isinstance(response, ErrorResponse):
-            print(f"Error: {response.detail}")
+        voices = await self.catalogue.get(self)
+        if voices is None:
             return
 
-        for voice in response.get_voices():
-            if voice_name and voice.name == voice_name \
-                    or voice_id and voice.voice_id == voice_id:
-                self.voice_id = voice.voice_id
-                self.voice_name = voice.name
+        for name, catalogue_voice_id in voices.items():
+            if voice_name and name == voice_name \
+                    or voice_id and catalogue_voice_id == voice_id:
+                self.voice_id = catalogue_voice_id
+                self.voice_name = name
                 break
 
     async def get_voices(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{API_BASE_URL}/voices", headers={"xi-api-key": self.api_key}) as response:
-                data = await response.json()
-                if response.status != 200:
-                    return ErrorResponse(data, response.status)
-
-                voices = [Voice(**voice_data) for voice_data in data.get("voices", [])]
-                return VoicesResponse(voices)
-
-    async def synthesize_speech(self, text, voice_id=None, stability=0, similarity_boost=0):
-        """
-        Synthesize speech from text
-        :param text:
-        :param voice_id:
-        :param stability:
-        :param similarity_boost:
-        :return:
-        """
+        async with self.throttler.request(
+                self.session, "GET", f"{API_BASE_URL}/voices",
+                endpoint="voices",
+        ) as response:
+            data = await response.json()
+            if response.status != 200:
+                return ErrorResponse(data, response.status)
+
+            voices = [Voice(**voice_data) for voice_data in data.get("voices", [])]
+            return VoicesResponse(voices)
+
+    def _speech_request(self, text, voice_id=None, stability=0, similarity_boost=0, model_id=None, stream=False):
         payload = {
             "text": text,
             "voice_settings": {
@@ -71,16 +108,37 @@ class TextToSpeech:
                 "similarity_boost": similarity_boost
             }
         }
-        headers = {"xi-api-key": self.api_key, "Content-Type": "application/json"}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{API_BASE_URL}/text-to-speech/{voice_id or self.voice_id}",
-                                    data=json.dumps(payload),
-                                    headers=headers) as response:
-                data = await response.json() if response.status != 200 else None
-                if response.status != 200:
-                    return ErrorResponse(data, response.status)
-                audio_data = await response.read()
-                return audio_data
-
-
+        if model_id:
+            payload["model_id"] = model_id
+        headers = {"Content-Type": "application/json"}
+        # the streaming endpoint sends the audio while it's still being generated
+        url = f"{API_BASE_URL}/text-to-speech/{voice_id or self.voice_id}" + ("/stream" if stream else "")
+
+        return self.throttler.request(
+            self.session, "POST", url,
+            endpoint="text-to-speech",
+            data=json.dumps(payload),
+            headers=headers,
+        )
+
+    async def synthesize_speech_to_file(self, text, filename: Union[str, Path], voice_id=None, stability=0,
+                                        similarity_boost=0, model_id=None, chunk_size=CHUNK_SIZE, stream=False):
+        """
+        Synthesize speech from text, streaming the audio straight to disk
+        :param text:
+        :param filename: where to save the audio, replaced atomically
+        :param voice_id:
+        :param stability:
+        :param similarity_boost:
+        :param model_id: the account default model if not set
+        :param chunk_size: size of the chunks read from the response
+        :param stream: use the streaming endpoint, which starts sending audio sooner
+        :return: the filename, or ErrorResponse
+        """
+        async with self._speech_request(
+                text, voice_id, stability, similarity_boost, model_id, stream=stream
+        ) as response:
+            if response.status != 200:
+                return ErrorResponse(await response.json(), response.status)
+            await save_audio_stream(response, filename, chunk_size)
+            return filename
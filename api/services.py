@@ -2,16 +2,16 @@ import aiomisc
 
 from api.eleven_labs.tts_converter import TTSConverter
 from config import settings
+from database.engine import PoolMetricsService
 
-with aiomisc.entrypoint(
-        TTSConverter(
-            api_key=settings.e11_labs_key,
-            voice="Antoni",
-            pguser=settings.PG_LOGIN,
-            pgpass=settings.PG_PASS,
-            host=settings.PG_HOST,
-            database=settings.PG_DATABASE,
-        ),
+converter = TTSConverter(
+    api_key=settings.e11_labs_key,
+    voice="Antoni",
+    save_folder=settings.audio_path,
+    redis_url=settings.get("redis_url"),
+    audio_cache_size=settings.get("audio_cache_size"),
+)
 
-) as loop:
-    pass
+with aiomisc.entrypoint(converter, PoolMetricsService()) as loop:
+    if converter.task is not None:
+        loop.run_until_complete(converter.task)
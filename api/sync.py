@@ -0,0 +1,15 @@
+import aiomisc
+
+from api.drivers_services.crawler import CourseCrawler
+from config import settings
+from database.engine import PoolMetricsService
+
+with aiomisc.entrypoint(
+        CourseCrawler(
+            username=settings.test_pravo_login,
+            password=settings.test_pravo_pass,
+            image_folder=settings.image_path,
+        ),
+        PoolMetricsService(),
+) as loop:
+    pass
@@ -1,11 +1,66 @@
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-import asyncpg
-from bs4 import BeautifulSoup
-from langdetect import detect, detector_factory
+from langdetect import detect, detector_factory, DetectorFactory, LangDetectException
+from redis import asyncio as aioredis
 
-# Initialize langdetect
-detector_factory.init_factory()
+from api.utils.html_text import get_extractor
+from api.utils.lang_fastpath import classify
+from api.utils.language_cache import LanguageCache
+from database.models import content_hash
+from database.notify import notify_course_changed_raw
+
+# fragment -> language memo of the current process
+language_cache = LanguageCache()
+
+# bump when the output of `process_text` changes, so the incremental mode reprocesses all slides
+PROCESSOR_VERSION = 2
+
+
+def language_cache_version(fast_path, seed):
+    """
+    Describe the detector configuration the persisted language cache is valid for.
+    """
+    return f"v{PROCESSOR_VERSION}-{'fastpath' if fast_path else 'langdetect'}-seed{seed}"
+
+
+def init_worker(seed=0, cache_entries=None):
+    """
+    Initialize langdetect and the language cache once per worker process.
+
+    Args:
+        seed (int): Seed of the detector, so the same text is always detected the same way.
+        cache_entries (dict): Fragment -> language entries known from the previous runs.
+    """
+    DetectorFactory.seed = seed
+    detector_factory.init_factory()
+    if cache_entries:
+        language_cache.update(cache_entries)
+
+
+def detect_language(fragment, fast_path=True):
+    """
+    Detect the language of a text fragment.
+
+    Args:
+        fragment (str): The text fragment.
+        fast_path (bool): Try the cheap Polish / English classifier first,
+            langdetect runs only if it isn't confident.
+
+    Returns:
+        str: The language code, an empty string if it can't be detected (e.g. digits only).
+    """
+    if fast_path:
+        lang = classify(fragment)
+        if lang is not None:
+            return lang
+
+    try:
+        return detect(fragment)
+    except LangDetectException:
+        return ''
 
 
 async def update_formatted_content(pool, slide_id, formatted_content):
@@ -23,22 +78,56 @@ async def update_formatted_content(pool, slide_id, formatted_content):
                                slide_id)
 
 
-def process_text(text):
+async def update_formatted_contents(pool, records, version=PROCESSOR_VERSION):
+    """
+    Update the formatted_content column of many slides at once.
+
+    The records are copied into a temporary table, then the slides are updated from it
+    in a single statement, so the whole batch costs a few round-trips and one transaction.
+
+    Args:
+        pool (asyncpg.Pool): An instance of asyncpg connection pool.
+        records (list): A list of (slide_id, formatted_content, content_hash) tuples,
+            content_hash being the md5 of the content the slide was processed from.
+        version (int): The version of the processor which made the formatted content.
+    """
+    if not records:
+        return
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "CREATE TEMPORARY TABLE formatted_contents "
+                "(id integer PRIMARY KEY, formatted_content text, content_hash text) ON COMMIT DROP"
+            )
+            await conn.copy_records_to_table(
+                "formatted_contents", records=records, columns=("id", "formatted_content", "content_hash")
+            )
+            await conn.execute(
+                "UPDATE slides SET formatted_content = t.formatted_content, "
+                "content_hash = t.content_hash, processed_version = $1 "
+                "FROM formatted_contents t WHERE slides.id = t.id",
+                version,
+            )
+            await notify_course_changed_raw(conn)
+
+
+def process_text(text, fast_path=True, extractor="htmlparser"):
     """
     Process a single text and separate English and Polish text.
 
     Args:
         text (str): A string containing the text to process.
+        fast_path (bool): Use the cheap Polish / English classifier before langdetect.
+        extractor (str): The HTML text extractor, see `api.utils.html_text.EXTRACTORS`.
 
     Returns:
         tuple: A tuple containing the separated English and Polish texts.
     """
-    soup = BeautifulSoup(text, 'html.parser')
-
     english_text = ''
     polish_text = ''
-    for t in soup.stripped_strings:
-        lang = detect(t)
+    for t in get_extractor(extractor)(text):
+        lang = language_cache.detect(t, partial(detect_language, fast_path=fast_path))
         if lang == 'en':
             english_text += ' ' + t
         elif lang == 'pl':
@@ -50,61 +139,232 @@ def process_text(text):
     return english_text, polish_text
 
 
+def process_chunk(texts, fast_path=True, extractor="htmlparser"):
+    """
+    Process a chunk of texts in a worker process.
+
+    Args:
+        texts (list): A list of strings containing the texts to process.
+        fast_path (bool): Use the cheap Polish / English classifier before langdetect.
+        extractor (str): The HTML text extractor, see `api.utils.html_text.EXTRACTORS`.
+
+    Returns:
+        tuple: A list of tuples containing the separated English and Polish texts,
+            the language cache entries learned while processing and the cache hits and misses.
+    """
+    hits, misses = language_cache.hits, language_cache.misses
+    processed_texts = [process_text(text, fast_path, extractor) for text in texts]
+    return (
+        processed_texts,
+        language_cache.drain_new(),
+        language_cache.hits - hits,
+        language_cache.misses - misses,
+    )
+
+
 class TextProcessor:
-    def __init__(self, db_name, db_user, db_password, db_host, db_port=None):
-        self.db_name = db_name
-        self.db_user = db_user
-        self.db_password = db_password
-        self.db_host = db_host
-        self.db_port = db_port
+    def __init__(self, incremental=False, workers=None, chunk_size=64, seed=0, language_cache_path=None, redis_url=None,
+                 fast_path=True, batch_size=1024, prefetch=256, batches_in_flight=2,
+                 html_extractor=None):
+        # process only the new slides, the edited ones and those made by an older PROCESSOR_VERSION
+        self.incremental = incremental
+
+        # language detection is CPU-bound, so it runs in a pool of `workers` processes
+        # (one per core by default), texts are sent to them in chunks of `chunk_size`
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.fast_path = fast_path
+        if html_extractor is None:
+            from config import settings
+
+            html_extractor = settings.get("html_extractor", "htmlparser")
+        # validated here, so a typo fails before the workers start
+        get_extractor(html_extractor)
+        self.html_extractor = html_extractor
+
+        # slides are streamed from a cursor fetching `prefetch` rows per round-trip and
+        # processed in batches of `batch_size`, at most `batches_in_flight` at once,
+        # so the memory is bounded and reading, processing and writing overlap
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.batches_in_flight = batches_in_flight
+
+        # detected fragment languages are kept between runs in a file and/or Redis
+        self.language_cache = LanguageCache(version=language_cache_version(fast_path, seed))
+        self.language_cache_path = language_cache_path
+        self.redis_url = redis_url
+
+    def create_executor(self):
+        """
+        Create the pool of processes separating the languages.
+
+        Returns:
+            ProcessPoolExecutor: The pool, each worker with langdetect and the language cache
+                already initialized.
+        """
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_worker,
+            initargs=(self.seed, self.language_cache.snapshot()),
+        )
+
+    async def load_language_cache(self):
+        """
+        Load the fragment language cache persisted by the previous runs.
+        """
+        if self.language_cache_path:
+            self.language_cache.load(self.language_cache_path)
+        if self.redis_url:
+            redis = aioredis.from_url(self.redis_url)
+            try:
+                await self.language_cache.load_redis(redis)
+            finally:
+                await redis.close()
+
+    async def save_language_cache(self):
+        """
+        Persist the fragment language cache for the next runs.
+        """
+        logging.info(
+            f"Language cache: {len(self.language_cache)} fragments, {self.language_cache.hits} hits, "
+            f"{self.language_cache.misses} misses ({self.language_cache.hit_ratio:.1%} hit ratio)"
+        )
+        if self.language_cache_path:
+            self.language_cache.dump(self.language_cache_path)
+        if self.redis_url:
+            redis = aioredis.from_url(self.redis_url)
+            try:
+                await self.language_cache.dump_redis(redis)
+            finally:
+                await redis.close()
 
     async def create_conn_pool(self):
         """
-        Create a connection pool to the PostgreSQL database.
+        Get the connection pool to the PostgreSQL database, shared by the whole process.
 
         Returns:
             asyncpg.Pool: An instance of asyncpg connection pool.
         """
-        return await asyncpg.create_pool(
-            database=self.db_name,
-            user=self.db_user,
-            password=self.db_password,
-            host=self.db_host,
-            port=self.db_port
-        )
+        # imported here, so the worker processes don't need the database settings
+        from database.engine import get_pool
+
+        return await get_pool()
 
-    async def process_database_texts(self, pool):
+    async def process_database_texts(self, pool, executor=None):
         """
         Process the content of all slides in the database and update the formatted_content column.
 
+        The slides are read with a server-side cursor, every batch is written back as soon
+        as it is processed while the next ones are read and processed.
+
         Args:
             pool (asyncpg.Pool): An instance of asyncpg connection pool.
+            executor (ProcessPoolExecutor): The pool to process the texts in, a new one if not set.
         """
-        async with pool.acquire() as conn:
-            texts = [
-                (record['id'], record['content'])
-                for record in await conn.fetch("SELECT id, content FROM slides")
-            ]
+        if executor is None:
+            with self.create_executor() as executor:
+                return await self.process_database_texts(pool, executor)
+
+        query = "SELECT id, content FROM slides"
+        args = []
+        if self.incremental:
+            query += " WHERE content_hash IS DISTINCT FROM md5(content) OR processed_version IS DISTINCT FROM $1"
+            args.append(PROCESSOR_VERSION)
+
+        pending = set()
+        updated = 0
+        try:
+            async with pool.acquire() as conn:
+                # cursors live only inside a transaction
+                async with conn.transaction():
+                    batch = []
+                    async for record in conn.cursor(query, *args, prefetch=self.prefetch):
+                        batch.append((record['id'], record['content']))
+                        if len(batch) < self.batch_size:
+                            continue
+
+                        pending.add(asyncio.create_task(self.process_batch(pool, executor, batch)))
+                        batch = []
+                        if len(pending) >= self.batches_in_flight:
+                            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            updated += sum(task.result() for task in done)
 
-        processed_texts = self.process_texts([text[1] for text in texts])
+                    if batch:
+                        pending.add(asyncio.create_task(self.process_batch(pool, executor, batch)))
 
-        for idx, (slide_id, content) in enumerate(texts):
-            _, formatted_text = processed_texts[idx]
-            print(f"Updating slide {slide_id} with formatted content")
-            await update_formatted_content(pool, slide_id, formatted_text)
+            updated += sum(await asyncio.gather(*pending))
+        finally:
+            for task in pending:
+                task.cancel()
 
-    def process_texts(self, texts):
+        logging.info(f"Updated formatted content of {updated} slides")
+
+    async def process_batch(self, pool, executor, batch):
+        """
+        Process a batch of slides in the executor and store the results.
+
+        Args:
+            pool (asyncpg.Pool): An instance of asyncpg connection pool.
+            executor (ProcessPoolExecutor): The pool to process the texts in.
+            batch (list): A list of (slide_id, content) tuples.
+
+        Returns:
+            int: The number of updated slides.
+        """
+        loop = asyncio.get_running_loop()
+        texts = [content for _, content in batch]
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, self.chunk_processor(), chunk)
+            for chunk in chunks
+        ))
+
+        processed_texts = []
+        for result in results:
+            processed_texts.extend(self.collect_chunk(*result))
+
+        records = [
+            (slide_id, formatted_text, content_hash(content))
+            for (slide_id, content), (_, formatted_text) in zip(batch, processed_texts)
+        ]
+        await update_formatted_contents(pool, records)
+        return len(records)
+
+    def chunk_processor(self):
+        return partial(process_chunk, fast_path=self.fast_path, extractor=self.html_extractor)
+
+    def collect_chunk(self, processed_chunk, cache_entries, hits, misses):
+        """
+        Merge what a worker learned while processing a chunk into the language cache.
+
+        Returns:
+            list: The processed texts of the chunk.
+        """
+        self.language_cache.update(cache_entries)
+        self.language_cache.hits += hits
+        self.language_cache.misses += misses
+        return processed_chunk
+
+    def process_texts(self, texts, executor=None):
         """
         Process a list of texts and separate English and Polish text.
 
         Args:
             texts (list): A list of strings containing the texts to process.
+            executor (ProcessPoolExecutor): The pool to process the texts in, a new one if not set.
 
         Returns:
             list: A list of tuples containing the separated English and Polish texts.
         """
-        with ThreadPoolExecutor() as executor:
-            processed_texts = list(executor.map(process_text, texts))
+        if executor is None:
+            with self.create_executor() as executor:
+                return self.process_texts(texts, executor)
+
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        processed_texts = []
+        for result in executor.map(self.chunk_processor(), chunks):
+            processed_texts.extend(self.collect_chunk(*result))
 
         return processed_texts
 
@@ -118,20 +378,23 @@ class TextProcessor:
         Main function to process and update the texts in the database.
         """
         pool = await self.create_conn_pool()
+        await self.load_language_cache()
 
         # Call the function to process and update the database texts
-        await self.process_database_texts(pool)
+        with self.create_executor() as executor:
+            await self.process_database_texts(pool, executor)
+
+        await self.save_language_cache()
 
         # Close the connection pool
-        await pool.close()
+        from database.engine import close
+
+        await close()
 
 
 """if __name__ == "__main__":
-    # Replace these values with your own database credentials
+    # the database credentials are taken from the settings by database.engine
 
-    processor = TextProcessor(
-        settings.PG_DATABASE, settings.PG_LOGIN,
-        settings.PG_PASS, settings.PG_HOST
-    )
+    processor = TextProcessor()
     asyncio.run(processor.main())
 """
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Extraction of the text nodes of the slide HTML.
+
+`process_text` only needs the stripped text nodes of a slide, in document order.
+Building a BeautifulSoup tree for that is the most expensive part of processing a
+slide after language detection, so the extractors here stream the text nodes out
+of a parser without building a tree:
+
+* "bs4" - BeautifulSoup with html.parser, the reference output;
+* "htmlparser" - an `html.parser.HTMLParser` subclass, same tokenizer as "bs4";
+* "lxml" - the libxml2 parser with a target, needs lxml to be installed; it differs
+  from "bs4" on malformed markup (CDATA sections, unknown entities).
+
+All of them skip comments, declarations and the contents of script, style and
+template tags, like `BeautifulSoup.stripped_strings` does.
+"""
+from html import unescape
+from html.entities import html5
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterator, List
+
+from bs4 import BeautifulSoup
+
+# tags whose contents BeautifulSoup doesn't consider text
+SKIPPED_TAGS = frozenset(("script", "style", "template"))
+
+
+def bs4_strings(html: str) -> Iterator[str]:
+    return BeautifulSoup(html, 'html.parser').stripped_strings
+
+
+class _TextCollector:
+    """
+    Joins the data of a text node delivered in pieces and keeps it if it isn't blank.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._buffer: List[str] = []
+        self._skipped = 0
+
+    def text(self, data: str) -> None:
+        if not self._skipped:
+            self._buffer.append(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            text = ''.join(self._buffer).strip()
+            self._buffer = []
+            if text:
+                self.strings.append(text)
+
+    def start(self, tag: str) -> None:
+        self.flush()
+        if tag in SKIPPED_TAGS:
+            self._skipped += 1
+
+    def end(self, tag: str) -> None:
+        self.flush()
+        if tag in SKIPPED_TAGS and self._skipped:
+            self._skipped -= 1
+
+
+class _StringsParser(HTMLParser):
+    def __init__(self):
+        # character references are resolved by hand to match BeautifulSoup
+        super().__init__(convert_charrefs=False)
+        self.collector = _TextCollector()
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.flush()
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.text(data)
+
+    def handle_entityref(self, name):
+        character = html5.get(name + ';')
+        # unknown entities are kept as they are, without the semicolon, like in bs4
+        self.collector.text(character if character is not None else f"&{name}")
+
+    def handle_charref(self, name):
+        self.collector.text(unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self.collector.flush()
+
+    def handle_decl(self, decl):
+        self.collector.flush()
+
+    def handle_pi(self, data):
+        self.collector.flush()
+
+    def unknown_decl(self, data):
+        self.collector.flush()
+        if data.upper().startswith("CDATA["):
+            self.collector.text(data[len("CDATA["):])
+            self.collector.flush()
+
+
+def htmlparser_strings(html: str) -> Iterator[str]:
+    parser = _StringsParser()
+    parser.feed(html)
+    parser.close()
+    parser.collector.flush()
+    return iter(parser.collector.strings)
+
+
+class _LxmlTarget(_TextCollector):
+    """
+    Parser target receiving the lxml events, see `lxml.etree.HTMLParser(target=...)`.
+    """
+
+    def start(self, tag, attrib):
+        super().start(tag)
+
+    data = _TextCollector.text
+
+    def comment(self, text):
+        self.flush()
+
+    def pi(self, target, data=None):
+        self.flush()
+
+    def doctype(self, *args):
+        self.flush()
+
+    def close(self):
+        self.flush()
+        return self.strings
+
+
+def lxml_strings(html: str) -> Iterator[str]:
+    try:
+        from lxml import etree
+    except ImportError as e:
+        raise RuntimeError("The lxml HTML extractor needs lxml to be installed") from e
+
+    if not html.strip():
+        return iter(())
+    return iter(etree.fromstring(html, etree.HTMLParser(target=_LxmlTarget())))
+
+
+EXTRACTORS: Dict[str, Callable[[str], Iterator[str]]] = {
+    "bs4": bs4_strings,
+    "htmlparser": htmlparser_strings,
+    "lxml": lxml_strings,
+}
+
+
+def get_extractor(name: str) -> Callable[[str], Iterator[str]]:
+    """
+    Get the text node extractor by its name.
+
+    Args:
+        name (str): One of "bs4", "htmlparser" or "lxml".
+
+    Returns:
+        callable: Function returning the stripped text nodes of an HTML string.
+    """
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown HTML extractor {name!r}, expected one of {', '.join(EXTRACTORS)}") from None
@@ -0,0 +1,151 @@
+"""
+Cheap Polish / English classifier for text fragments.
+
+The slides contain only Polish and English, so most fragments can be decided
+without langdetect: Polish diacritics, stopwords and a character-trigram model
+held in a NumPy array. `classify` returns None when the evidence is weak, and the
+caller falls back to langdetect.
+"""
+import re
+import zlib
+from typing import Optional
+
+import numpy as np
+
+POLISH = "pl"
+ENGLISH = "en"
+
+POLISH_DIACRITICS = frozenset("ąćęłńóśźż")
+
+# words spelled the same in both languages ("a", "to", "do", "by", "we", "ten") are left out
+POLISH_STOPWORDS = frozenset("""
+aby ale bez bo być był była było były czy dla gdy gdzie go i ich im jak jako jednak
+jego jej jest jeśli jeżeli już kiedy która które który lub ma może mu na nad nie niż
+o od oraz po pod przed przez przy się są ta tak tam te tego tej tu tylko tym w więc
+z za ze że żeby
+""".split())
+
+ENGLISH_STOPWORDS = frozenset("""
+about after all an and any are as at be been before but can does for from has have he
+if in into is it its may must not of on or should so than that the their them then
+there these they this was were what when where which while who will with you your
+""".split())
+
+# Samples the trigram model is built from, in the register of the course slides.
+POLISH_SAMPLE = """
+Kierujący pojazdem jest obowiązany zachować szczególną ostrożność podczas zbliżania się
+do przejścia dla pieszych. Znak ostrzegawczy informuje o niebezpiecznym zakręcie w prawo.
+Na skrzyżowaniu równorzędnym należy ustąpić pierwszeństwa pojazdom nadjeżdżającym z prawej
+strony. Przed rozpoczęciem wyprzedzania sprawdź, czy masz odpowiednią widoczność i czy
+droga jest wolna na wystarczającym odcinku. Prędkość pojazdu należy dostosować do warunków
+atmosferycznych, natężenia ruchu i stanu nawierzchni. Kierowca, który spowodował wypadek
+drogowy, powinien udzielić niezbędnej pomocy ofiarom i wezwać pogotowie ratunkowe.
+W obszarze zabudowanym dopuszczalna prędkość wynosi pięćdziesiąt kilometrów na godzinę.
+Zatrzymanie pojazdu jest zabronione na przejeździe kolejowym, w tunelu oraz na moście.
+Pytanie dotyczy zasad pierwszeństwa przejazdu i znaczenia sygnałów świetlnych. Światło
+żółte oznacza zakaz wjazdu za sygnalizator, chyba że zatrzymanie pojazdu wymagałoby
+gwałtownego hamowania. Pasy bezpieczeństwa muszą zapiąć wszyscy pasażerowie samochodu.
+Odpowiedź prawidłowa to ta, która wskazuje właściwe zachowanie kierującego w tej sytuacji.
+Czy w tej sytuacji masz obowiązek zatrzymać pojazd przed linią warunkowego zatrzymania?
+Policjant kierujący ruchem wydaje polecenia i sygnały, które mają pierwszeństwo przed znakami.
+"""
+
+ENGLISH_SAMPLE = """
+The driver of a vehicle must take particular care when approaching a pedestrian crossing.
+The warning sign informs about a dangerous bend to the right. At an intersection of equal
+roads you should give way to vehicles approaching from the right side. Before you start
+overtaking, check whether you have enough visibility and whether the road is clear for a
+sufficient distance. The speed of the vehicle should be adjusted to the weather conditions,
+the traffic volume and the condition of the road surface. A driver who caused a road
+accident should give the necessary help to the victims and call an ambulance. In a built-up
+area the speed limit is fifty kilometres per hour. Stopping a vehicle is prohibited on a
+railway crossing, in a tunnel and on a bridge. The question concerns the rules of right of
+way and the meaning of traffic lights. The yellow light means you must not pass the signal,
+unless stopping the vehicle would require sudden braking. All passengers of the car must
+fasten their seat belts. The correct answer is the one that shows the proper behaviour of
+the driver in this situation. Are you obliged to stop the vehicle before the stop line?
+A police officer directing traffic gives orders and signals that take precedence over signs.
+"""
+
+BUCKETS = 4096
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def _trigram_indices(text: str) -> np.ndarray:
+    padded = f" {' '.join(_WORD.findall(text.lower()))} "
+    return np.fromiter(
+        (zlib.crc32(padded[i:i + 3].encode()) % BUCKETS for i in range(len(padded) - 2)),
+        dtype=np.int64,
+    )
+
+
+def _log_probabilities(sample: str) -> np.ndarray:
+    counts = np.bincount(_trigram_indices(sample), minlength=BUCKETS).astype(np.float64)
+    # add-one smoothing, so unseen trigrams don't zero the probability out
+    counts += 1
+    return np.log(counts / counts.sum())
+
+
+# row 0 is Polish, row 1 English
+TRIGRAM_TABLE = np.vstack([_log_probabilities(POLISH_SAMPLE), _log_probabilities(ENGLISH_SAMPLE)])
+
+
+def trigram_score(text: str) -> float:
+    """
+    Mean per-trigram log-likelihood ratio of Polish over English.
+
+    Returns:
+        float: Positive for Polish-like text, negative for English-like, 0 without trigrams.
+    """
+    indices = _trigram_indices(text)
+    if not indices.size:
+        return 0.0
+    polish, english = TRIGRAM_TABLE[:, indices].sum(axis=1)
+    return float((polish - english) / indices.size)
+
+
+def classify(text: str, min_score: float = 0.35, min_words: int = 2,
+             diacritic_weight: float = 1.0) -> Optional[str]:
+    """
+    Decide between Polish and English on cheap evidence.
+
+    Words with Polish diacritics count as Polish evidence next to the Polish stopwords,
+    so an English sentence quoting a Polish sign or street name stays English.
+
+    Args:
+        text (str): The fragment to classify.
+        min_score (float): Minimal mean trigram log-likelihood ratio to trust the model.
+        min_words (int): Fragments with fewer words are left to langdetect,
+            unless they contain Polish diacritics.
+        diacritic_weight (float): Weight of a word with Polish diacritics against a stopword.
+
+    Returns:
+        str: "pl" or "en", None if the evidence is too weak.
+    """
+    lowered = text.lower()
+    words = _WORD.findall(lowered)
+    diacritic_words = sum(not POLISH_DIACRITICS.isdisjoint(word) for word in words)
+    english_stopwords = sum(word in ENGLISH_STOPWORDS for word in words)
+
+    # diacritics settle it only if nothing points to English
+    if diacritic_words and not english_stopwords:
+        return POLISH
+    if len(words) < min_words:
+        return None
+
+    polish_evidence = sum(word in POLISH_STOPWORDS for word in words) + diacritic_weight * diacritic_words
+    score = trigram_score(lowered)
+
+    # both signals have to agree, or the trigram model alone has to be sure
+    if polish_evidence > english_stopwords and score > 0:
+        return POLISH
+    if english_stopwords > polish_evidence and score < 0:
+        return ENGLISH
+    if score >= min_score * 2:
+        return POLISH
+    if score <= -min_score * 2:
+        return ENGLISH
+    if abs(score) >= min_score and polish_evidence == english_stopwords == 0:
+        return POLISH if score > 0 else ENGLISH
+    return None
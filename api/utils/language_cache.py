@@ -0,0 +1,121 @@
+import json
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+from redis import asyncio as aioredis
+
+
+class LanguageCache:
+    """
+    LRU-bounded memo of text fragment -> detected language.
+
+    The same fragments ("Pytanie", "Answer", repeated legal phrases) show up in
+    thousands of slides, so the n-gram detection runs once per distinct fragment.
+    Entries added since the last `drain_new` call are tracked, so a worker process
+    can send what it learned back to the parent, which persists the cache to a file
+    or Redis between runs.
+
+    The persisted copies are tagged with `version`, which describes the detector
+    configuration, so languages detected by another configuration aren't reused.
+    """
+
+    def __init__(self, maxsize: int = 100_000, version: str = ""):
+        self.maxsize = maxsize
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._new: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, fragment: str) -> Optional[str]:
+        lang = self._data.get(fragment)
+        if lang is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._data.move_to_end(fragment)
+        return lang
+
+    def set(self, fragment: str, lang: str) -> None:
+        self._data[fragment] = lang
+        self._data.move_to_end(fragment)
+        self._new[fragment] = lang
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def detect(self, fragment: str, detector: Callable[[str], str]) -> str:
+        """
+        Get the language of the fragment, running `detector` on a cache miss.
+        """
+        lang = self.get(fragment)
+        if lang is None:
+            lang = detector(fragment)
+            self.set(fragment, lang)
+        return lang
+
+    def update(self, entries: Dict[str, str]) -> None:
+        for fragment, lang in entries.items():
+            self._data[fragment] = lang
+            self._data.move_to_end(fragment)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def drain_new(self) -> Dict[str, str]:
+        new, self._new = self._new, {}
+        return new
+
+    def snapshot(self) -> Dict[str, str]:
+        return dict(self._data)
+
+    def load(self, path: Union[Path, str]) -> None:
+        path = Path(path)
+        if not path.exists():
+            return
+        with path.open(encoding="utf-8") as fp:
+            stored = json.load(fp)
+        # files without a version were written before the detector configuration was tracked
+        if not isinstance(stored, dict) or stored.get("version") != self.version or "entries" not in stored:
+            logging.info(f"Ignoring the language cache in {path}, it was made by another detector configuration")
+            return
+        self.update(stored["entries"])
+        logging.info(f"Loaded {len(self)} language cache entries from {path}")
+
+    def dump(self, path: Union[Path, str]) -> None:
+        path = Path(path)
+        temp_path = path.with_name(path.name + ".part")
+        with temp_path.open("w", encoding="utf-8") as fp:
+            json.dump({"version": self.version, "entries": self.snapshot()}, fp, ensure_ascii=False)
+        temp_path.replace(path)
+
+    def redis_key(self, prefix: str) -> str:
+        # snapshots of other detector configurations live under other keys
+        return f"{prefix}:{self.version}" if self.version else prefix
+
+    async def load_redis(self, redis: aioredis.Redis, key: str = "lang:fragments") -> None:
+        entries = await redis.hgetall(self.redis_key(key))
+        self.update({
+            fragment.decode(): lang.decode()
+            for fragment, lang in entries.items()
+        })
+        logging.info(f"Loaded {len(entries)} language cache entries from Redis")
+
+    async def dump_redis(self, redis: aioredis.Redis, key: str = "lang:fragments", batch_size: int = 1000) -> None:
+        key = self.redis_key(key)
+        items = list(self.snapshot().items())
+        # the stored copy mirrors the bounded cache instead of growing forever
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            for i in range(0, len(items), batch_size):
+                pipe.hset(key, mapping=dict(items[i:i + batch_size]))
+            await pipe.execute()
@@ -0,0 +1,41 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one.
+
+    The first caller of a key starts the call in its own task, the callers coming
+    while it runs wait for the same task. Everybody gets its result or its exception.
+    A caller being cancelled doesn't cancel the call for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `call`, or wait for the call of `key` already running.
+
+        Args:
+            key: Identifies the calls to coalesce.
+            call (callable): Coroutine function to run if no call of `key` is running.
+
+        Returns:
+            The result of the call.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(call())
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # the callers may all be gone, don't log the exception as never retrieved
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, FrozenSet, Optional
+
+import aiohttp
+from yarl import URL
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, bursts of up to `capacity`.
+
+    Waiters are served in FIFO order. `block` empties the bucket for a while,
+    e.g. when the server answered with `Retry-After`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        # below one token the bucket could never hold a whole request
+        self.capacity = max(1.0, capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def block(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase / multiplicative decrease.
+
+    Every successful request grows the limit by `increase / limit` (so roughly by
+    `increase` per round of requests), every throttled one multiplies it by `decrease`.
+    Decreases closer than `cooldown` seconds are merged, so a burst of 429 answers
+    to requests sent at the same time counts as one signal.
+    """
+
+    def __init__(
+            self, initial: int = 4, minimum: int = 1, maximum: int = 32,
+            increase: float = 1.0, decrease: float = 0.5, cooldown: float = 1.0,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self) -> "AIMDLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.release()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def on_throttle(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        logging.info(f"Throttled, concurrency limit lowered to {int(self.limit)}")
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_statuses: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+    throttle_statuses: FrozenSet[int] = frozenset({429, 503})
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter.
+
+        Args:
+            attempt (int): Number of the failed attempt, starting from 0.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a `Retry-After` header, given either in seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass
+class Throttler:
+    """
+    Rate limiting and retries for outbound HTTP requests.
+
+    Each endpoint has its own token bucket, all of them share one AIMD concurrency
+    limit. Responses with a retryable status are retried with jittered exponential
+    backoff, honouring `Retry-After`; the last response is returned as is, so the
+    caller handles the error the same way it would without retries.
+    """
+    rate: float = 10.0
+    burst: Optional[float] = None
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    concurrency: AIMDLimiter = field(default_factory=AIMDLimiter)
+
+    def __post_init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, endpoint: str) -> TokenBucket:
+        if endpoint not in self._buckets:
+            self._buckets[endpoint] = TokenBucket(self.rate, self.burst)
+        return self._buckets[endpoint]
+
+    @asynccontextmanager
+    async def request(
+            self, session: aiohttp.ClientSession, method: str, url: str,
+            endpoint: Optional[str] = None, **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Perform a request through the rate limiter, retrying throttled and failed attempts.
+
+        Args:
+            session (aiohttp.ClientSession): Session to send the request with.
+            method (str): HTTP method.
+            url (str): Request URL.
+            endpoint (str): Name of the rate limited endpoint, the URL host by default.
+            **kwargs: Passed to `session.request`.
+
+        Yields:
+            aiohttp.ClientResponse: The final response.
+        """
+        bucket = self.bucket(endpoint or URL(url).host)
+
+        for attempt in range(self.retry.attempts):
+            last_attempt = attempt == self.retry.attempts - 1
+
+            await bucket.acquire()
+            await self.concurrency.acquire()
+            try:
+                try:
+                    response = await session.request(method, url, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if last_attempt:
+                        raise
+                    delay = self.retry.backoff(attempt)
+                    logging.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+                else:
+                    if response.status not in self.retry.retry_statuses or last_attempt:
+                        if response.status not in self.retry.retry_statuses:
+                            self.concurrency.on_success()
+                        async with response:
+                            yield response
+                        return
+
+                    response.release()
+                    delay = self.retry_delay(response, bucket, attempt)
+                    logging.warning(
+                        f"{method} {url} answered {response.status}, "
+                        f"retry {attempt + 1}/{self.retry.attempts - 1} in {delay:.1f}s"
+                    )
+            finally:
+                await self.concurrency.release()
+
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, response: aiohttp.ClientResponse, bucket: TokenBucket, attempt: int) -> float:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status in self.retry.throttle_statuses:
+            self.concurrency.on_throttle()
+            if retry_after is not None:
+                # nobody should hit this endpoint until the server is ready again
+                bucket.block(retry_after)
+
+        return max(retry_after or 0.0, self.retry.backoff(attempt))
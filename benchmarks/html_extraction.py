@@ -0,0 +1,52 @@
+"""
+Compare the HTML text extractors used by `process_text`.
+
+Checks that every extractor yields the same text nodes as BeautifulSoup
+(the reference) on each slide and reports slides/sec of each of them.
+
+Usage:
+    python -m benchmarks.html_extraction [--file slides.json] [--limit N] [--repeat N]
+
+Without --file the slide HTML is read from the `slides` table.
+"""
+import argparse
+import time
+
+from api.utils.html_text import EXTRACTORS
+from benchmarks.slides import add_arguments, load_slides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the slides per extractor")
+    parser.add_argument("--show", type=int, default=3, help="mismatching slides to print per extractor")
+    args = parser.parse_args()
+    slides = load_slides(args.file, args.limit)
+
+    reference = [list(EXTRACTORS["bs4"](slide)) for slide in slides]
+    print(f"{len(slides)} slides")
+    for name, extract in EXTRACTORS.items():
+        try:
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                for slide in slides:
+                    list(extract(slide))
+            elapsed = time.perf_counter() - started
+        except RuntimeError as e:
+            print(f"{name:>10}: {e}")
+            continue
+
+        mismatches = [
+            (slide, expected, actual)
+            for slide, expected, actual in zip(slides, reference, (list(extract(slide)) for slide in slides))
+            if expected != actual
+        ]
+        print(f"{name:>10}: {len(slides) * args.repeat / elapsed:10.1f} slides/s, "
+              f"{len(slides) - len(mismatches)}/{len(slides)} slides identical to bs4")
+        for slide, expected, actual in mismatches[:args.show]:
+            print(f"    {slide[:200]!r}\n      bs4: {expected}\n      {name}: {actual}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare the language separation of `process_text` with and without the fast path.
+
+Reports fragments/sec and slides/sec for both modes, how many fragments the fast
+path decides on its own, and how often it agrees with langdetect.
+
+Usage:
+    python -m benchmarks.language_detection [--file slides.json] [--limit N]
+
+Without --file the slide HTML is read from the `slides` table.
+"""
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+from api.utils import convert_texts
+from api.utils.convert_texts import init_worker, process_text, detect_language
+from api.utils.lang_fastpath import classify
+from api.utils.language_cache import LanguageCache
+from benchmarks.slides import add_arguments, load_slides
+
+
+def timed(func, items):
+    started = time.perf_counter()
+    results = [func(item) for item in items]
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    slides = load_slides(args.file, args.limit)
+
+    init_worker()
+    fragments = [
+        fragment
+        for slide in slides
+        for fragment in BeautifulSoup(slide, 'html.parser').stripped_strings
+    ]
+
+    reference, langdetect_time = timed(lambda f: detect_language(f, fast_path=False), fragments)
+    fast, fast_time = timed(classify, fragments)
+    decided = [(lang, ref) for lang, ref in zip(fast, reference) if lang is not None]
+    agreed = sum(lang == ref for lang, ref in decided)
+
+    print(f"{len(slides)} slides, {len(fragments)} fragments")
+    print(f"langdetect:  {len(fragments) / langdetect_time:10.0f} fragments/s")
+    print(f"fast path:   {len(fragments) / fast_time:10.0f} fragments/s, "
+          f"decided {len(decided) / max(len(fragments), 1):.1%}, "
+          f"agreement with langdetect {agreed / max(len(decided), 1):.1%}")
+
+    # the memo would hide the detection cost, so every mode starts without it
+    results = {}
+    for fast_path in (False, True):
+        convert_texts.language_cache = LanguageCache(maxsize=0)
+        results[fast_path], elapsed = timed(lambda text: process_text(text, fast_path), slides)
+        print(f"process_text(fast_path={fast_path}): {len(slides) / elapsed:8.1f} slides/s")
+
+    identical = sum(a == b for a, b in zip(results[False], results[True]))
+    print(f"identical output: {identical}/{len(slides)} slides")
+
+
+if __name__ == "__main__":
+    main()
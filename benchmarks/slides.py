@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import asyncpg
+
+
+async def fetch_slides(limit):
+    from config import POSTGRES_URI
+
+    conn = await asyncpg.connect(POSTGRES_URI)
+    try:
+        records = await conn.fetch("SELECT content FROM slides WHERE content IS NOT NULL LIMIT $1", limit)
+    finally:
+        await conn.close()
+    return [record['content'] for record in records]
+
+
+def load_slides(path=None, limit=1000):
+    """
+    Load the HTML of the slides to benchmark on.
+
+    Args:
+        path (str): JSON file with a list of slide HTML strings, the `slides` table if not set.
+        limit (int): Maximal number of slides.
+
+    Returns:
+        list: The slide HTML strings.
+    """
+    if path:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)[:limit]
+    return asyncio.run(fetch_slides(limit))
+
+
+def add_arguments(parser):
+    parser.add_argument("--file", help="JSON file with a list of slide HTML strings")
+    parser.add_argument("--limit", type=int, default=1000, help="number of slides to read from the database")
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+import aiomisc
+import asyncpg
+import msgpack
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from api.utils.single_flight import SingleFlight
+from config import settings, POSTGRES_URI
+from database.notify import COURSE_CHANGED
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    In-memory read-through cache with a time to live of the entries.
+
+    The course (modules, slides and the keyboards built from them) changes only
+    when it is synced or processed again, so the bot serves it from memory and
+    drops everything on a `COURSE_CHANGED` notification, the TTL only bounds the
+    staleness if a notification is missed.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._loads = SingleFlight()
+        # bumped by every invalidation, so a load started before it isn't stored
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def invalidate(self, key: Hashable = _MISSING) -> None:
+        """
+        Drop the entry of `key`, or all the entries if it isn't given.
+        """
+        self.generation += 1
+        if key is _MISSING:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = None) -> Any:
+        """
+        Get the value of `key`, loading it with `load` if it isn't cached.
+
+        Concurrent calls with the same key share one `load` call.
+
+        Args:
+            key: The cache key.
+            load (callable): Coroutine function returning the value.
+            ttl (float): Time to live of the entry, the default one if not set.
+
+        Returns:
+            The cached or loaded value.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return await self._loads.run(key, lambda: self._load(key, load, ttl))
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]], ttl: Optional[float]) -> Any:
+        generation = self.generation
+        value = await load()
+        if generation == self.generation:
+            self.set(key, value, ttl)
+        return value
+
+
+class SharedCache:
+    """
+    Cache shared by the bot replicas in Redis.
+
+    Values are stored msgpack-encoded under `<prefix>:<namespace>:<key>`, reads and
+    writes of several keys take one round-trip. Invalidating a namespace deletes its
+    keys and is published on `channel`, so every replica drops its in-memory copy.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str = "bot", ttl: int = 3600,
+                 channel: str = "bot:invalidate"):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.channel = channel
+
+    def key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    async def get_many(self, namespace: str, keys: Iterable[str]) -> List[Any]:
+        """
+        Get the values of the keys, None for the missing ones.
+        """
+        values = await self.redis.mget([self.key(namespace, key) for key in keys])
+        return [None if value is None else msgpack.unpackb(value) for value in values]
+
+    async def set_many(self, namespace: str, values: Mapping[str, Any], ttl: Optional[int] = None) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(self.key(namespace, key), msgpack.packb(value), ex=ttl or self.ttl)
+            await pipe.execute()
+
+    async def invalidate(self, namespace: str, batch_size: int = 500) -> None:
+        keys = [key async for key in self.redis.scan_iter(match=self.key(namespace, "*"), count=batch_size)]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for i in range(0, len(keys), batch_size):
+                pipe.delete(*keys[i:i + batch_size])
+            pipe.publish(self.channel, namespace)
+            await pipe.execute()
+
+    async def listen(self, on_invalidate: Callable[[str], None]) -> None:
+        """
+        Call `on_invalidate` with the namespace invalidated by any replica, until cancelled.
+        """
+        async with self.redis.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    on_invalidate(message["data"].decode())
+
+
+# namespace of the course data in the shared cache
+COURSE = "course"
+
+course_cache = TTLCache(ttl=settings.get("bot_cache_ttl", 600))
+
+# the replicas share the course and Telegram file ids through Redis when it's configured
+shared_cache: Optional[SharedCache] = None
+if settings.get("redis_url"):
+    shared_cache = SharedCache(
+        aioredis.from_url(settings.redis_url),
+        ttl=settings.get("bot_shared_cache_ttl", 3600),
+    )
+
+
+async def get_course(key: str, load: Callable[[], Awaitable[Any]], dump: Callable[[Any], Any] = None,
+                     restore: Callable[[Any], Any] = None) -> Any:
+    """
+    Get a piece of the course from memory, the shared cache or `load` it from the database.
+
+    Args:
+        key (str): The cache key.
+        load (callable): Coroutine function loading the value from the database.
+        dump (callable): Converts the value to msgpack-serializable data.
+        restore (callable): Converts the data back to the value.
+
+    Returns:
+        The value.
+    """
+    async def load_shared():
+        if shared_cache is None:
+            return await load()
+
+        generation = course_cache.generation
+        try:
+            data, = await shared_cache.get_many(COURSE, [key])
+        except RedisError as e:
+            logging.warning(f"Shared cache is unavailable: {e}")
+            return await load()
+        if data is not None:
+            return restore(data) if restore else data
+
+        value = await load()
+        # don't share a value loaded before the course changed
+        if generation == course_cache.generation:
+            try:
+                await shared_cache.set_many(COURSE, {key: dump(value) if dump else value})
+            except RedisError as e:
+                logging.warning(f"Shared cache is unavailable: {e}")
+        return value
+
+    return await course_cache.get_or_load(key, load_shared)
+
+
+class CacheInvalidator(aiomisc.Service):
+    """
+    Listens to the `COURSE_CHANGED` notifications and invalidates the cache.
+
+    The listening connection is reopened after `reconnect_delay` seconds when lost,
+    the cache is dropped on every (re)connect as notifications could have been missed.
+    With a shared cache, the notified replicas also clear the course namespace in Redis,
+    and every replica drops its memory on the invalidations published there.
+    """
+
+    def __init__(self, cache: TTLCache = course_cache, shared: Optional[SharedCache] = None,
+                 reconnect_delay: float = 5, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.shared = shared or shared_cache
+        self.reconnect_delay = reconnect_delay
+        self.task: Optional[asyncio.Task] = None
+        self.shared_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self.listen())
+        if self.shared is not None:
+            self.shared_task = asyncio.create_task(self.listen_shared())
+
+    async def listen_shared(self) -> None:
+        while True:
+            try:
+                await self.shared.listen(self.on_shared_invalidation)
+            except RedisError as e:
+                logging.error(f"Can't listen to the shared cache invalidations: {e}")
+            # invalidations could have been missed
+            self.cache.invalidate()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def on_shared_invalidation(self, namespace: str) -> None:
+        if namespace == COURSE:
+            self.cache.invalidate()
+
+    async def invalidate_shared(self) -> None:
+        try:
+            await self.shared.invalidate(COURSE)
+        except RedisError as e:
+            logging.error(f"Can't invalidate the shared cache: {e}")
+
+    async def listen(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(POSTGRES_URI)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                await conn.add_listener(COURSE_CHANGED, self.on_notification)
+                self.cache.invalidate()
+                await closed.wait()
+                logging.warning("Lost the course change notifications connection")
+            except (OSError, asyncpg.PostgresError) as e:
+                logging.error(f"Can't listen to the course change notifications: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    def on_notification(self, conn, pid, channel, payload) -> None:
+        logging.info("Course changed, invalidating the bot cache")
+        self.cache.invalidate()
+        if self.shared is not None:
+            asyncio.ensure_future(self.invalidate_shared())
+
+    async def stop(self, exception: Optional[Exception] = None) -> None:
+        tasks = [task for task in (self.task, self.shared_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,6 +1,7 @@
-from typing import Optional
+from typing import List, Optional
 
 from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 
 class ModuleCallbackFactory(CallbackData, prefix="module"):
@@ -9,6 +10,33 @@ class ModuleCallbackFactory(CallbackData, prefix="module"):
 
 
 class SlideCallbackFactory(CallbackData, prefix="slide"):
+    # "select" a slide (value is the slide id), or go to the "next" / "previous"
+    # page of a module (value is the module id) from the slide at (lesson, cursor)
     action: str
     value: Optional[int]
+    lesson: Optional[int] = None
+    cursor: Optional[int] = None
 
+
+def dump_markup(markup: InlineKeyboardMarkup) -> List[List[dict]]:
+    """
+    Convert a keyboard of callback buttons to msgpack-serializable rows.
+    """
+    return [
+        [
+            dict(
+                text=button.text,
+                callback_data=button.callback_data.pack()
+                if isinstance(button.callback_data, CallbackData) else button.callback_data,
+            )
+            for button in row
+        ]
+        for row in markup.inline_keyboard
+    ]
+
+
+def restore_markup(rows: List[List[dict]]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(**button) for button in row]
+        for row in rows
+    ])
@@ -2,12 +2,16 @@ import asyncio
 from dataclasses import dataclass
 from typing import Optional, List
 
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import selectinload
 
-from config import settings
-from database.models import Module, Slide
+from bot.cache import get_course
+from bot.db_operations.pagination import Page, SlideKey, fetch_slides_page
+from bot.db_operations.read_models import ModuleItem, SlideBody, restore_modules
+from database.engine import get_engine
+from database.models import Module, Slide, AudioDubbing, Attachment
 
 
 @dataclass
@@ -16,24 +20,96 @@ class DBUsage:
     async_session = None
 
     async def init(self) -> None:
-        self.engine = create_async_engine(
-            "postgresql+asyncpg://"
-            f"{settings.PG_LOGIN}:{settings.PG_PASS}@{settings.PG_HOST}"
-            f"/{settings.PG_DATABASE}",
-        )
+        self.engine = get_engine()
 
         # async_sessionmaker: a factory for new AsyncSession objects.
         # expire_on_commit - don't expire objects after transaction commit
         self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
 
-    async def get_modules(self) -> Optional[List[Module]]:
+    async def get_modules(self) -> List[ModuleItem]:
+        return await get_course("modules", self._get_modules, restore=restore_modules)
+
+    async def _get_modules(self) -> List[ModuleItem]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(Module.id, Module.name).order_by(Module.moduleNumber, Module.id)
+            )
+            return [ModuleItem(*row) for row in result]
+
+    async def get_slides_page(self, module_id: int, page_size: int, after: Optional[SlideKey] = None,
+                              before: Optional[SlideKey] = None) -> Page:
+        async with self.engine.connect() as conn:
+            return await fetch_slides_page(conn, module_id, page_size, after=after, before=before)
+
+    async def get_slide_body(self, slide_id: int) -> Optional[SlideBody]:
+        """
+        Load what is needed to show and dub an opened slide.
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(Slide.id, Slide.name, Slide.formatted_content).where(Slide.id == slide_id)
+            )
+            row = result.first()
+            return SlideBody(*row) if row is not None else None
+
+    async def get_slide_audio(self, slide_id: int) -> Optional[AudioDubbing]:
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(AudioDubbing).where(AudioDubbing.slide_id == slide_id).limit(1)
+            )
+            return result.scalar()
+
+    async def add_audio_dubbing(self, slide_id: int, filename: str) -> None:
+        async with self.engine.begin() as conn:
+            # the batch converter may have stored the slide's dubbing meanwhile
+            await conn.execute(
+                insert(AudioDubbing).values(slide_id=slide_id, audio=filename)
+                .on_conflict_do_nothing(index_elements=[AudioDubbing.slide_id])
+            )
+
+    async def get_slide_attachments(self, slide_id: int) -> List[Attachment]:
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(Attachment).where(Attachment.slide_id == slide_id).order_by(Attachment.id)
+            )
+            return list(result.scalars())
+
+    async def set_audio_file_id(self, dubbing_id: int, file_id: Optional[str]) -> None:
         async with self.async_session() as session:
-            stmt = select(Module)  # .options(selectinload(Module.slides))
-            result = await session.execute(stmt)
+            async with session.begin():
+                await session.execute(
+                    update(AudioDubbing).where(AudioDubbing.id == dubbing_id).values(telegram_file_id=file_id)
+                )
 
-            return [i for i in result.scalars()]
+    async def set_attachment_file_id(self, attachment_id: int, file_id: Optional[str]) -> None:
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    update(Attachment).where(Attachment.id == attachment_id).values(telegram_file_id=file_id)
+                )
+
+    async def get_unsent_audio(self, after_id: int = 0, limit: int = 100) -> List[AudioDubbing]:
+        """
+        Get the audio dubbings not uploaded to Telegram yet, in id order starting after `after_id`.
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(AudioDubbing)
+                .where(AudioDubbing.telegram_file_id.is_(None), AudioDubbing.id > after_id)
+                .order_by(AudioDubbing.id)
+                .limit(limit)
+            )
+            return list(result.scalars())
 
-    async def get_slides(self, slide_id: int):
+    async def get_unsent_attachments(self, after_id: int = 0, limit: int = 100) -> List[Attachment]:
+        """
+        Get the attachments not uploaded to Telegram yet, in id order starting after `after_id`.
+        """
         async with self.async_session() as session:
-            slides = await session.execute(select(Slide).where(Slide.module_id == slide_id))
-            return [i for i in slides.scalars()]
+            result = await session.execute(
+                select(Attachment)
+                .where(Attachment.telegram_file_id.is_(None), Attachment.id > after_id)
+                .order_by(Attachment.id)
+                .limit(limit)
+            )
+            return list(result.scalars())
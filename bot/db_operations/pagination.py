@@ -1,38 +1,85 @@
-"""from aiogram import types
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.sql import Select
 
-def create_pagination_buttons(current_page: int, total_pages: int, page_callback_prefix: str):
-    keyboard = InlineKeyboardBuilder()
+from bot.db_operations.read_models import SlideItem
+from database.models import Slide
 
-    # Define button labels
-    first_page = '«1'
-    previous_page = f'‹ {current_page - 1}'
-    current_page_label = f'• {current_page} •'
-    next_page = f'{current_page + 1} ›'
-    last_page = f'{total_pages}»'
+# position of a slide in a module: (lessonNumber, id)
+SlideKey = Tuple[int, int]
 
-    # Add buttons based on the current page
-    if current_page > 1:
-        keyboard.add(
-            types.InlineKeyboardButton(text=first_page, callback_data=f'{page_callback_prefix}:1'),
-            types.InlineKeyboardButton(text=previous_page, callback_data=f'{page_callback_prefix}:{current_page - 1}')
-        )
 
-    keyboard.add(types.InlineKeyboardButton(text=current_page_label, callback_data='current_page'))
+@dataclass
+class Page:
+    items: List[SlideItem]
+    has_previous: bool
+    has_next: bool
 
-    if current_page < total_pages:
-        keyboard.add(
-            types.InlineKeyboardButton(text=next_page, callback_data=f'{page_callback_prefix}:{current_page + 1}'),
-            types.InlineKeyboardButton(text=last_page, callback_data=f'{page_callback_prefix}:{total_pages}')
-        )
+    @property
+    def first_key(self) -> Optional[SlideKey]:
+        return (self.items[0].lessonNumber, self.items[0].id) if self.items else None
 
-    return keyboard
+    @property
+    def last_key(self) -> Optional[SlideKey]:
+        return (self.items[-1].lessonNumber, self.items[-1].id) if self.items else None
 
 
-print(
-    [i.text for i in create_pagination_buttons(2, 86, 'page').buttons]
-)
-"""
-# Deprecated, a lot of bugs
-# Path: bot/db_operations/pagination.py
+def slides_page_query(module_id: int, limit: int, after: Optional[SlideKey] = None,
+                      before: Optional[SlideKey] = None) -> Select:
+    """
+    Build the keyset query of a page of the slides of a module.
+
+    The rows are read from the (module_id, lessonNumber, id) index, so the cost depends
+    on the page size only, not on how far the page is.
+
+    Args:
+        module_id (int): The module of the slides.
+        limit (int): Maximal number of slides.
+        after (tuple): Key of the slide the page starts after.
+        before (tuple): Key of the slide the page ends before, the slides are in reverse order then.
+
+    Returns:
+        Select: Query of the slide id, name and lessonNumber.
+    """
+    key = tuple_(Slide.lessonNumber, Slide.id)
+    query = select(Slide.id, Slide.name, Slide.lessonNumber).where(Slide.module_id == module_id)
+    if before is not None:
+        return query.where(key < tuple_(*before)) \
+            .order_by(Slide.lessonNumber.desc(), Slide.id.desc()).limit(limit)
+    if after is not None:
+        query = query.where(key > tuple_(*after))
+    return query.order_by(Slide.lessonNumber, Slide.id).limit(limit)
+
+
+async def fetch_slides_page(conn: AsyncConnection, module_id: int, page_size: int,
+                            after: Optional[SlideKey] = None, before: Optional[SlideKey] = None) -> Page:
+    """
+    Fetch a page of the slides of a module.
+
+    One more row than the page size is requested to know if there is a page further.
+
+    Args:
+        conn (AsyncConnection): The connection to query in.
+        module_id (int): The module of the slides.
+        page_size (int): Number of slides on a page.
+        after (tuple): Key of the last slide of the previous page, the first page if not set.
+        before (tuple): Key of the first slide of the next page, to go back.
+
+    Returns:
+        Page: The slides of the page.
+    """
+    if before is not None:
+        result = await conn.execute(slides_page_query(module_id, page_size + 1, before=before))
+        rows = [SlideItem(*row) for row in result]
+        if len(rows) >= page_size:
+            rows.reverse()
+            return Page(rows[-page_size:], has_previous=len(rows) > page_size, has_next=True)
+        # the slides before were removed in the meantime, start over
+        after = None
+
+    result = await conn.execute(slides_page_query(module_id, page_size + 1, after=after))
+    rows = [SlideItem(*row) for row in result]
+    return Page(rows[:page_size], has_previous=after is not None, has_next=len(rows) > page_size)
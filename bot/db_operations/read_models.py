@@ -0,0 +1,32 @@
+"""
+Rows the bot reads, holding only the columns it renders.
+
+They are plain tuples built from column-projected selects, so no ORM identity
+map, no change tracking and no slide HTML is loaded for a keyboard. They are
+msgpack-serializable as they are, `restore` builds them back from the shared cache.
+"""
+from typing import List, NamedTuple, Optional
+
+
+class ModuleItem(NamedTuple):
+    id: int
+    name: str
+
+
+class SlideItem(NamedTuple):
+    id: int
+    name: str
+    lessonNumber: int
+
+
+class SlideBody(NamedTuple):
+    """
+    An opened slide: what is shown and dubbed.
+    """
+    id: int
+    name: str
+    formatted_content: Optional[str]
+
+
+def restore_modules(rows: List[list]) -> List[ModuleItem]:
+    return [ModuleItem(*row) for row in rows]
@@ -1,28 +1,113 @@
+import asyncio
+from contextlib import suppress
 from typing import Optional, Any
 
 import aiomisc
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
 
 import bot.routers.instanses
-from bot.routers import db
+from bot.cache import CacheInvalidator, shared_cache
+from bot.media import MediaPrewarmer
+from bot.outbound import OutboundScheduler
+from bot.routers import db, speech, media
+from bot.webhook import UpdateProcessor, WebhookServer
 from config import settings
+from database.engine import PoolMetricsService
 
 
-class BotService(aiomisc.Service):
-    dp: Dispatcher = Dispatcher()
+def create_storage() -> BaseStorage:
+    # the replicas share the FSM states through Redis when it's configured
+    if shared_cache is not None:
+        return RedisStorage(shared_cache.redis)
+    return MemoryStorage()
+
+
+def create_bot() -> Bot:
     bot = Bot(settings.bot_token, parse_mode="HTML")
+    # every request of the bot waits for its turn within the Telegram flood limits
+    bot.session.middleware(OutboundScheduler(
+        global_rate=settings.get("telegram_global_rate", 30),
+        chat_rate=settings.get("telegram_chat_rate", 1),
+        chat_burst=settings.get("telegram_chat_burst", 3),
+        max_retries=settings.get("telegram_max_retries", 3),
+    ))
+    return bot
+
+
+class BotService(aiomisc.Service):
+    dp: Dispatcher = Dispatcher(storage=create_storage())
+    bot = create_bot()
+    prewarm_task: Optional[asyncio.Task] = None
+    webhook: Optional[WebhookServer] = None
 
     async def start(self):
         await db.init()
+        await speech.init(db)
+        media.init(self.bot, db)
+
+        # upload the media in the background, so users get it by reference
+        if settings.get("media_channel_id"):
+            prewarmer = MediaPrewarmer(
+                media, db, settings.media_channel_id,
+                interval=settings.get("media_prewarm_interval", 3),
+                period=settings.get("media_prewarm_period", 600),
+            )
+            self.prewarm_task = asyncio.create_task(prewarmer.run_forever())
 
         self.dp.include_router(bot.routers.instanses.router)
-        await self.dp.start_polling(self.bot)
+        if settings.get("bot_mode", "polling") == "webhook":
+            await self.start_webhook()
+        else:
+            await self.dp.start_polling(self.bot)
+
+    async def start_webhook(self):
+        """
+        Serve the updates from the webhook, so several bot processes can run behind a load balancer.
+        """
+        processor = UpdateProcessor(
+            self.dp, self.bot,
+            max_concurrency=settings.get("webhook_max_concurrency", 100),
+            max_chat_backlog=settings.get("webhook_max_chat_backlog", 10),
+        )
+        self.webhook = WebhookServer(
+            processor,
+            path=settings.get("webhook_path", "/webhook"),
+            host=settings.get("webhook_host", "0.0.0.0"),
+            port=settings.get("webhook_port", 8080),
+            secret_token=settings.get("webhook_secret") or None,
+        )
+        await self.webhook.start()
+
+        # every replica registers the same url, so it doesn't matter which one does it last
+        await self.bot.set_webhook(
+            settings.webhook_base_url.rstrip("/") + self.webhook.path,
+            secret_token=self.webhook.secret_token,
+            allowed_updates=self.dp.resolve_used_update_types(),
+        )
 
     async def stop(self, exception: Optional[Exception] = None) -> Any:
-        ...
+        if self.webhook is not None:
+            # the webhook stays registered for the other replicas
+            await self.webhook.stop()
+        else:
+            # the polling may have been stopped by a signal already
+            with suppress(RuntimeError):
+                await self.dp.stop_polling()
+        if self.prewarm_task is not None:
+            self.prewarm_task.cancel()
+        await speech.close()
+        await self.bot.session.close()
+        # closes the Redis connections shared with the cache as well
+        await self.dp.storage.close()
 
 
 with aiomisc.entrypoint(
     BotService(),
+    CacheInvalidator(),
+    PoolMetricsService(),
 ) as loop:
-    pass
+    # in the polling mode BotService.start doesn't return
+    loop.run_forever()
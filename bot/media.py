@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import FSInputFile, Message
+
+from api.drivers_services.crawler import is_image
+from api.utils.single_flight import SingleFlight
+from bot.db_operations import DBUsage
+from bot.outbound import BROADCAST, priority
+from database.models import Attachment, AudioDubbing
+
+
+class MediaDelivery:
+    """
+    Sends the slide media, uploading every file to Telegram only once.
+
+    The `file_id` Telegram returns for the first upload is stored with the
+    `AudioDubbing` / `Attachment` row, later sends reference it instead of uploading
+    the file again. Concurrent first sends of the same file share one upload.
+    """
+
+    def __init__(self, audio_folder: Union[Path, str] = "files", image_folder: Union[Path, str] = "images"):
+        self.audio_folder = Path(audio_folder)
+        self.image_folder = Path(image_folder)
+        self.bot: Optional[Bot] = None
+        self.db: Optional[DBUsage] = None
+        self._uploads = SingleFlight()
+
+    def init(self, bot: Bot, db: DBUsage) -> None:
+        self.bot = bot
+        self.db = db
+
+    async def send_audio(self, chat_id: Union[int, str], dubbing: AudioDubbing,
+                         caption: Optional[str] = None) -> Message:
+        async def store(file_id):
+            dubbing.telegram_file_id = file_id
+            await self.db.set_audio_file_id(dubbing.id, file_id)
+
+        return await self._send(
+            ("audio", dubbing.id), dubbing.telegram_file_id, self.audio_folder / dubbing.audio,
+            lambda media: self.bot.send_voice(chat_id, media, caption=caption),
+            # Telegram may keep an MP3 as an audio file instead of a voice message
+            lambda message: (message.voice or message.audio).file_id,
+            store,
+        )
+
+    async def send_image(self, chat_id: Union[int, str], attachment: Attachment,
+                         caption: Optional[str] = None) -> Message:
+        async def store(file_id):
+            attachment.telegram_file_id = file_id
+            await self.db.set_attachment_file_id(attachment.id, file_id)
+
+        return await self._send(
+            ("image", attachment.id), attachment.telegram_file_id, self.image_folder / attachment.file,
+            lambda media: self.bot.send_photo(chat_id, media, caption=caption),
+            # the largest of the generated sizes
+            lambda message: message.photo[-1].file_id,
+            store,
+        )
+
+    async def send_slide_images(self, chat_id: Union[int, str], slide_id: int) -> None:
+        for attachment in await self.db.get_slide_attachments(slide_id):
+            if not is_image(attachment.file):
+                continue
+            try:
+                await self.send_image(chat_id, attachment)
+            except (OSError, TelegramAPIError):
+                logging.exception(f"Failed to send image {attachment.file} of slide {slide_id}")
+
+    async def _send(self, key: Tuple[str, int], file_id: Optional[str], path: Path,
+                    send: Callable[[Union[str, FSInputFile]], Awaitable[Message]],
+                    get_file_id: Callable[[Message], str],
+                    store: Callable[[str], Awaitable[None]]) -> Message:
+        if file_id:
+            try:
+                return await send(file_id)
+            except TelegramBadRequest as e:
+                # e.g. the file id of another bot, upload the file again
+                logging.warning(f"Can't send {path} by its file id: {e}")
+
+        uploaded = False
+
+        async def upload() -> Message:
+            # the file is uploaded to the chat of the caller which started the upload
+            nonlocal uploaded
+            uploaded = True
+            message = await send(FSInputFile(path))
+            await store(get_file_id(message))
+            return message
+
+        message = await self._uploads.run(key, upload)
+        if uploaded:
+            return message
+        # the others get the file by the id of that upload
+        return await send(get_file_id(message))
+
+
+class MediaPrewarmer:
+    """
+    Uploads all the media not uploaded yet to a private channel, so users never wait for an upload.
+
+    The files are sent one every `interval` seconds (Telegram allows about 20 messages
+    a minute in a channel), waiting as long as Telegram asks on flood control.
+    `run_forever` repeats the pass every `period` seconds, picking up the media
+    the crawler and the converters have added since.
+    """
+
+    def __init__(self, delivery: MediaDelivery, db: DBUsage, chat_id: Union[int, str],
+                 batch_size: int = 100, interval: float = 3, period: float = 600):
+        self.delivery = delivery
+        self.db = db
+        self.chat_id = chat_id
+        self.batch_size = batch_size
+        self.interval = interval
+        self.period = period
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                # e.g. the database being unavailable, the next pass tries again
+                logging.exception("Failed to pre-warm the media")
+            await asyncio.sleep(self.period)
+
+    async def run(self) -> None:
+        # the uploads give way to the replies to the users
+        with priority(BROADCAST):
+            audio = await self.prewarm(self.db.get_unsent_audio, self.delivery.send_audio)
+            images = await self.prewarm(
+                self.db.get_unsent_attachments, self.delivery.send_image,
+                lambda attachment: is_image(attachment.file),
+            )
+        logging.info(f"Media pre-warmed: {audio} audio files, {images} images uploaded")
+
+    async def prewarm(self, get_unsent: Callable[[int, int], Awaitable[list]],
+                      send: Callable[[Union[int, str], object], Awaitable[Message]],
+                      accept: Callable[[object], bool] = lambda row: True) -> int:
+        uploaded = 0
+        last_id = 0
+        while True:
+            rows = await get_unsent(last_id, self.batch_size)
+            if not rows:
+                return uploaded
+
+            for row in rows:
+                last_id = row.id
+                if not accept(row) or row.telegram_file_id:
+                    continue
+                if await self.upload(send, row):
+                    uploaded += 1
+                await asyncio.sleep(self.interval)
+
+    async def upload(self, send: Callable[[Union[int, str], object], Awaitable[Message]], row) -> bool:
+        while True:
+            try:
+                await send(self.chat_id, row)
+                return True
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (OSError, TelegramAPIError):
+                logging.exception(f"Failed to pre-warm {type(row).__name__} {row.id}")
+                return False
@@ -0,0 +1,181 @@
+"""
+Scheduling of the requests the bot sends, within the Telegram flood limits.
+
+Telegram answers 429 with `retry_after` to a bot sending more than about 30
+messages a second overall, or more than about one a second to the same chat.
+`OutboundScheduler` is a request middleware of the bot session, so every
+`answer`, `edit_reply_markup` or `send_*` call of the handlers goes through it.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, TelegramMethod
+
+from api.utils.throttling import TokenBucket
+
+# priorities of the requests, the lower the sooner
+URGENT = 0  # callback query answers, the user sees a spinner until then
+INTERACTIVE = 1  # replies to the users
+BROADCAST = 2  # background sends, e.g. the media pre-warming
+
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """
+    Send the requests made inside the block with the given priority.
+    """
+    token = outbound_priority.set(level)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class PriorityGate:
+    """
+    Lets the waiters through at the pace of a token bucket, the most urgent ones first.
+
+    Waiters of the same priority are let through in FIFO order.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, level: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._counter), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        while self._waiters:
+            await self.bucket.acquire()
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                # cancelled waiters don't take the token
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+
+@dataclass
+class _PendingEdit:
+    method: EditMessageReplyMarkup
+    task: Optional[asyncio.Task] = None
+    waiters: int = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Request middleware keeping the bot within the Telegram flood limits.
+
+    * every chat has its own token bucket of `chat_rate` messages a second;
+    * all the messages share a bucket of `global_rate` a second, the waiting requests
+      get through it by priority (see `priority`), so replies overtake broadcasts;
+    * a markup edit of a message which still waits to be sent replaces the waiting one,
+      both callers get the result of the single request, which is cancelled only when
+      all of them are;
+    * a 429 answer blocks the bucket of the chat (or the global one) for `retry_after`
+      seconds and the request is retried up to `max_retries` times.
+
+    Requests not addressed to a chat (getUpdates, setWebhook...) aren't throttled.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_retries: int = 3, max_chats: int = 10_000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.gate = PriorityGate(self.global_bucket)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self._edits: "dict[tuple, _PendingEdit]" = {}
+
+    def chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            # the least recently used chats are likely idle, their buckets are full anyway
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        if not isinstance(method, EditMessageReplyMarkup):
+            return await self.send(make_request, bot, method)
+
+        key = (method.chat_id, method.message_id, method.inline_message_id)
+        edit = self._edits.get(key)
+        if edit is not None:
+            # the waiting request will send this markup instead of its own
+            edit.method = method
+        else:
+            edit = self._edits[key] = _PendingEdit(method)
+            # the request runs in its own task, so the first caller leaving doesn't cancel it for the others
+            edit.task = asyncio.ensure_future(self.send(make_request, bot, method, edit=(key, edit)))
+            edit.task.add_done_callback(lambda task: self._forget_edit(key, edit, task))
+
+        edit.waiters += 1
+        try:
+            return await asyncio.shield(edit.task)
+        except asyncio.CancelledError:
+            edit.waiters -= 1
+            if not edit.waiters:
+                # the later edits make a new request instead of joining the cancelled one
+                self._forget_edit(key, edit)
+                edit.task.cancel()
+            raise
+
+    def _forget_edit(self, key: tuple, edit: _PendingEdit, task: Optional[asyncio.Task] = None) -> None:
+        if self._edits.get(key) is edit:
+            del self._edits[key]
+        # the callers may all be gone, don't log the exception as never retrieved
+        if task is not None and not task.cancelled():
+            task.exception()
+
+    async def send(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod,
+                   edit: Optional[Tuple[tuple, _PendingEdit]] = None) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        throttled = chat_id is not None or getattr(method, "inline_message_id", None) is not None \
+            or isinstance(method, AnswerCallbackQuery)
+        if not throttled:
+            return await make_request(bot, method)
+
+        level = URGENT if isinstance(method, AnswerCallbackQuery) else outbound_priority.get()
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self.chat_bucket(chat_id).acquire()
+            await self.gate.acquire(level)
+            if edit is not None:
+                # send the latest markup, the edits from now on make a new request
+                key, pending = edit
+                if self._edits.get(key) is pending:
+                    del self._edits[key]
+                method = pending.method
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Telegram asked to retry {type(method).__name__} after {e.retry_after}s")
+                bucket = self.chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(e.retry_after)
@@ -1,8 +1,29 @@
-from aiogram import types
+import asyncio
+import html
+import logging
+from typing import Optional
+
+import aiohttp
+from aiogram import types, F
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from bot.callbacks import ModuleCallbackFactory, SlideCallbackFactory
+from bot.cache import get_course
+from bot.callbacks import ModuleCallbackFactory, SlideCallbackFactory, dump_markup, restore_markup
+from bot.db_operations.pagination import SlideKey
+from bot.media import MediaDelivery
 from bot.routers import router, db
+from bot.speech import OnDemandSpeech
+from config import settings
+
+speech = OnDemandSpeech(
+    api_key=settings.e11_labs_key,
+    save_folder=settings.audio_path,
+    audio_cache_size=settings.get("audio_cache_size"),
+)
+media = MediaDelivery(audio_folder=settings.audio_path, image_folder=settings.image_path)
+
+# slides on a page of the module keyboard, Telegram allows 100 buttons at most
+SLIDES_PAGE_SIZE = settings.get("slides_page_size", 10)
 
 
 @router.callback_query(ModuleCallbackFactory.filter())
@@ -15,20 +36,90 @@ async def callbacks_num_change_fab(
     slides_markup = await get_slides_keyboard(callback_data.value)
     await callback.message.edit_reply_markup(
         inline_message_id=callback.inline_message_id,
-        reply_markup=slides_markup.as_markup()
+        reply_markup=slides_markup
     )
 
 
-async def get_slides_keyboard(slide_id: int):
+@router.callback_query(SlideCallbackFactory.filter(F.action.in_({"next", "previous"})))
+async def change_slides_page(
+        callback: types.CallbackQuery,
+        callback_data: SlideCallbackFactory
+):
+    await callback.answer()
+
+    key = (callback_data.lesson, callback_data.cursor)
+    if callback_data.action == "next":
+        slides_markup = await get_slides_keyboard(callback_data.value, after=key)
+    else:
+        slides_markup = await get_slides_keyboard(callback_data.value, before=key)
+    await callback.message.edit_reply_markup(
+        inline_message_id=callback.inline_message_id,
+        reply_markup=slides_markup
+    )
+
+
+async def get_slides_keyboard(module_id: int, after: Optional[SlideKey] = None,
+                              before: Optional[SlideKey] = None) -> types.InlineKeyboardMarkup:
+    position = f"after:{after[0]}:{after[1]}" if after else f"before:{before[0]}:{before[1]}" if before else "first"
+    return await get_course(
+        f"slides_keyboard:{module_id}:{position}",
+        lambda: build_slides_keyboard(module_id, after, before),
+        dump=dump_markup, restore=restore_markup,
+    )
+
+
+async def build_slides_keyboard(module_id: int, after: Optional[SlideKey] = None,
+                                before: Optional[SlideKey] = None) -> types.InlineKeyboardMarkup:
     slides_markup = InlineKeyboardBuilder()
-    slides = await db.get_slides(slide_id)
+    page = await db.get_slides_page(module_id, SLIDES_PAGE_SIZE, after=after, before=before)
 
-    for slide in slides:
-        button = types.InlineKeyboardButton(
+    for slide in page.items:
+        slides_markup.row(types.InlineKeyboardButton(
             text=slide.name,
-            callback_data=SlideCallbackFactory(action="select", value=slide.id)
-        )
-        slides_markup.add(button)
-    slides_markup.adjust(1)
+            callback_data=SlideCallbackFactory(action="select", value=slide.id).pack()
+        ))
+
+    navigation = []
+    if page.has_previous:
+        lesson, cursor = page.first_key
+        navigation.append(types.InlineKeyboardButton(
+            text="‹ Previous",
+            callback_data=SlideCallbackFactory(action="previous", value=module_id, lesson=lesson, cursor=cursor).pack()
+        ))
+    if page.has_next:
+        lesson, cursor = page.last_key
+        navigation.append(types.InlineKeyboardButton(
+            text="Next ›",
+            callback_data=SlideCallbackFactory(action="next", value=module_id, lesson=lesson, cursor=cursor).pack()
+        ))
+    if navigation:
+        slides_markup.row(*navigation)
+
+    return slides_markup.as_markup()
+
+
+@router.callback_query(SlideCallbackFactory.filter(F.action == "select"))
+async def select_slide(
+        callback: types.CallbackQuery,
+        callback_data: SlideCallbackFactory
+):
+    await callback.answer()
+
+    slide = await db.get_slide_body(callback_data.value)
+    if slide is None:
+        return
+
+    chat_id = callback.message.chat.id
+    await media.send_slide_images(chat_id, slide.id)
+
+    try:
+        # slides without pre-rendered audio are synthesized right now
+        dubbing = await speech.get_dubbing(slide)
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+        logging.exception(f"Failed to get the audio of slide {slide.id}")
+        dubbing = None
+    if dubbing is None:
+        await callback.message.answer(f"No audio for <b>{html.escape(slide.name)}</b> yet")
+        return
 
-    return slides_markup
+    await media.send_audio(chat_id, dubbing, caption=html.escape(slide.name))
@@ -3,7 +3,8 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from bot.callbacks import ModuleCallbackFactory
+from bot.cache import get_course
+from bot.callbacks import ModuleCallbackFactory, dump_markup, restore_markup
 from bot.db_operations import DBUsage
 from bot.routers.instanses import router
 
@@ -15,10 +16,14 @@ async def start(message: types.Message, state: FSMContext):
     """"""
     modules_markup = await get_modules_keyboard()
 
-    await message.answer("Select a module:", reply_markup=modules_markup.as_markup())
+    await message.answer("Select a module:", reply_markup=modules_markup)
 
 
-async def get_modules_keyboard():
+async def get_modules_keyboard() -> types.InlineKeyboardMarkup:
+    return await get_course("modules_keyboard", build_modules_keyboard, dump=dump_markup, restore=restore_markup)
+
+
+async def build_modules_keyboard() -> types.InlineKeyboardMarkup:
     modules_keyboard = InlineKeyboardBuilder()
     modules = await db.get_modules()
 
@@ -30,4 +35,4 @@ async def get_modules_keyboard():
         modules_keyboard.add(button)
     modules_keyboard.adjust(1)
 
-    return modules_keyboard
+    return modules_keyboard.as_markup()
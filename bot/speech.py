@@ -0,0 +1,95 @@
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+from api.eleven_labs.audio_cache import AudioCache, link_audio
+from api.eleven_labs.response_models import ErrorResponse
+from api.eleven_labs.voice_synth import TextToSpeech
+from api.utils.single_flight import SingleFlight
+from bot.db_operations import DBUsage
+from bot.db_operations.read_models import SlideBody
+from database.models import AudioDubbing
+
+
+class OnDemandSpeech:
+    """
+    Synthesizes the audio of slides which the batch `TTSConverter` hasn't dubbed yet.
+
+    The audio is requested from the ElevenLabs streaming endpoint and goes through
+    the same content-addressed cache as the batch, so concurrent users asking for
+    the same slide share one upstream call.
+    """
+
+    def __init__(self, api_key: str, voice: str = "Antoni", save_folder: Union[Path, str] = "files",
+                 audio_cache_size: Optional[int] = None):
+        self.voice = voice
+        self.save_location = Path(save_folder)
+        self.audio_cache_size = audio_cache_size
+        self.tts = TextToSpeech(api_key)
+        self.db: Optional[DBUsage] = None
+        self.audio_cache: Optional[AudioCache] = None
+        self._pending = SingleFlight()
+
+    async def init(self, db: DBUsage) -> None:
+        self.db = db
+        self.audio_cache = AudioCache(db.engine, self.save_location / "cache", max_size=self.audio_cache_size)
+        self.save_location.mkdir(exist_ok=True)
+
+        await self.tts.open()
+        await self.tts.set_voice(voice_name=self.voice)
+        if not self.tts.voice_id:
+            logging.error(f"Voice {self.voice} not found, on-demand audio is disabled")
+
+    async def close(self) -> None:
+        await self.tts.close()
+
+    async def get_dubbing(self, slide: SlideBody) -> Optional[AudioDubbing]:
+        """
+        Get the audio dubbing of the slide, synthesizing the audio if it wasn't dubbed yet.
+
+        Concurrent calls for the same slide share one lookup and synthesis.
+
+        Args:
+            slide (SlideBody): The slide to get the audio for.
+
+        Returns:
+            AudioDubbing: The dubbing, uploaded to Telegram or with its file on disk,
+                None if there is no audio.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: If ElevenLabs couldn't be reached.
+            OSError: If the audio couldn't be written.
+        """
+        # a user leaving doesn't cancel the synthesis for the others
+        return await self._pending.run(slide.id, lambda: self._get_dubbing(slide))
+
+    async def _get_dubbing(self, slide: SlideBody) -> Optional[AudioDubbing]:
+        dubbing = await self.db.get_slide_audio(slide.id)
+        if dubbing is not None and (dubbing.telegram_file_id or (self.save_location / dubbing.audio).exists()):
+            return dubbing
+
+        if not slide.formatted_content or not self.tts.voice_id:
+            return None
+
+        key = self.audio_cache.key(slide.formatted_content, self.tts.voice_id)
+        cached_audio = await self.audio_cache.get_or_create(
+            key, lambda path: self.synthesize(slide.formatted_content, path)
+        )
+        if cached_audio is None:
+            return None
+
+        # a dubbing whose file is gone gets it back under its own name
+        filename = dubbing.audio if dubbing is not None else f"{slide.id}.mp3"
+        link_audio(cached_audio, self.save_location / filename)
+        if dubbing is None:
+            await self.db.add_audio_dubbing(slide.id, filename)
+            # the batch converter may have stored its own dubbing meanwhile
+            dubbing = await self.db.get_slide_audio(slide.id)
+        return dubbing
+
+    async def synthesize(self, text: str, path: Path) -> bool:
+        speech_response = await self.tts.synthesize_speech_to_file(text, path, stream=True)
+        if isinstance(speech_response, ErrorResponse):
+            logging.error(f"Error while synthesizing speech: {speech_response.get_errors()}")
+            return False
+        return True
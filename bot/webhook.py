@@ -0,0 +1,141 @@
+import asyncio
+import hmac
+import logging
+from typing import Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: Update) -> Optional[int]:
+    """
+    Get the chat the update belongs to, the user for updates without a chat.
+    """
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class UpdateProcessor:
+    """
+    Processes updates concurrently, keeping the order of the updates of each chat.
+
+    At most `max_concurrency` updates are processed at once. An update waits for the
+    previous update of its chat, a chat can have up to `max_chat_backlog` updates
+    waiting, `submit` refuses the update beyond that so Telegram delivers it again later.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency: int = 100, max_chat_backlog: int = 10):
+        self.dp = dp
+        self.bot = bot
+        self.max_chat_backlog = max_chat_backlog
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # the last submitted update of every chat and the number of its pending updates
+        self._last: Dict[Optional[int], asyncio.Task] = {}
+        self._backlog: Dict[Optional[int], int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, update: Update) -> bool:
+        chat_id = update_chat_id(update)
+        if self._backlog.get(chat_id, 0) >= self.max_chat_backlog:
+            return False
+
+        self._backlog[chat_id] = self._backlog.get(chat_id, 0) + 1
+        task = asyncio.create_task(self._process(update, self._last.get(chat_id)))
+        self._last[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda _: self._done(chat_id, task))
+        return True
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # asyncio.wait doesn't cancel the previous update if this one is cancelled
+            await asyncio.wait({previous})
+
+        async with self._semaphore:
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logging.exception(f"Failed to process update {update.update_id}")
+
+    def _done(self, chat_id: Optional[int], task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._backlog[chat_id] -= 1
+        if not self._backlog[chat_id]:
+            del self._backlog[chat_id]
+        if self._last.get(chat_id) is task:
+            del self._last[chat_id]
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for the submitted updates, cancelling them after `timeout` seconds.
+        """
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class WebhookServer:
+    """
+    aiohttp server receiving the updates Telegram posts to the webhook.
+
+    Updates with a wrong secret token are rejected, the accepted ones are handed to
+    an `UpdateProcessor` and answered right away, so a slow handler doesn't hold
+    Telegram's connection.
+    """
+
+    def __init__(self, processor: UpdateProcessor, path: str = "/webhook", host: str = "0.0.0.0",
+                 port: int = 8080, secret_token: Optional[str] = None, shutdown_timeout: float = 30):
+        self.processor = processor
+        self.path = path
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self.shutdown_timeout = shutdown_timeout
+        self._runner: Optional[web.AppRunner] = None
+
+    def create_application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_TOKEN_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=401)
+
+        try:
+            update = Update(**await request.json())
+        except (ValueError, TypeError):
+            # not JSON, not an object or not an update (pydantic's ValidationError is a ValueError)
+            return web.Response(status=400)
+
+        if not self.processor.submit(update):
+            # Telegram retries the update later
+            return web.Response(status=429)
+        return web.Response()
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.create_application(), shutdown_timeout=self.shutdown_timeout)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """
+        Stop accepting updates and finish processing the accepted ones.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.processor.close(timeout=self.shutdown_timeout)
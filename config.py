@@ -11,5 +11,6 @@ settings = Dynaconf(
 POSTGRES_URI = f"postgresql://" \
                f"{settings.PG_LOGIN}" \
                f":{settings.PG_PASS}@{settings.PG_HOST}" \
+               f":{settings.get('PG_PORT', 5432)}" \
                f"/{settings.PG_DATABASE}"
 
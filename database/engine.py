@@ -0,0 +1,161 @@
+"""
+Database connections shared by everything running in a process.
+
+Each process gets one SQLAlchemy `AsyncEngine` and one asyncpg pool (for the raw
+COPY / cursor work of the text processor), both sized from settings.toml:
+
+* db_pool_size, db_max_overflow - connections kept open / opened on demand;
+* db_pool_pre_ping - check a connection is alive before handing it out;
+* db_statement_cache_size - prepared statements cached per connection, 0 behind pgbouncer;
+* db_command_timeout - seconds a single statement may run.
+
+Every process can open up to `db_pool_size + db_max_overflow` connections per pool,
+the sum over all the services running side by side has to stay under the
+`max_connections` of the server. `PoolMetricsService` logs how many of them are
+actually used to size them against it.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import aiomisc
+from aiomisc.service.periodic import PeriodicService
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from config import settings, POSTGRES_URI
+
+ASYNC_POSTGRES_URI = POSTGRES_URI.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+_engine: Optional[AsyncEngine] = None
+_pool: Optional[asyncio.Future] = None
+# the most engine connections checked out at once since the start
+_peak_checked_out = 0
+
+
+def pool_size() -> int:
+    return settings.get("db_pool_size", 5)
+
+
+def max_overflow() -> int:
+    return settings.get("db_max_overflow", 5)
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Get the engine of the process, creating it on the first call.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            ASYNC_POSTGRES_URI,
+            echo=settings.get("db_echo", False),
+            pool_size=pool_size(),
+            max_overflow=max_overflow(),
+            pool_pre_ping=settings.get("db_pool_pre_ping", True),
+            connect_args=dict(
+                prepared_statement_cache_size=settings.get("db_statement_cache_size", 100),
+                statement_cache_size=settings.get("db_statement_cache_size", 100),
+                command_timeout=settings.get("db_command_timeout", 60),
+            ),
+        )
+        event.listen(_engine.sync_engine, "checkout", _on_checkout)
+    return _engine
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    global _peak_checked_out
+    _peak_checked_out = max(_peak_checked_out, _engine.pool.checkedout())
+
+
+async def get_pool() -> asyncpg.Pool:
+    """
+    Get the asyncpg pool of the process, creating it on the first call.
+    """
+    global _pool
+    if _pool is None:
+        # concurrent first calls wait for the same pool
+        _pool = asyncio.ensure_future(asyncpg.create_pool(
+            POSTGRES_URI,
+            min_size=1,
+            max_size=pool_size() + max_overflow(),
+            statement_cache_size=settings.get("db_statement_cache_size", 100),
+            command_timeout=settings.get("db_command_timeout", 60),
+        ))
+    return await _pool
+
+
+async def close() -> None:
+    """
+    Close all the connections of the process.
+    """
+    global _engine, _pool
+    if _engine is not None:
+        log_pool_stats()
+        await _engine.dispose()
+        _engine = None
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await (await pool).close()
+
+
+def pool_stats() -> Dict[str, int]:
+    """
+    Get the utilisation of the connection pools created so far.
+
+    Returns:
+        dict: Connections open, in use, the limit and the peak use of the engine,
+            open, in use and the limit of the asyncpg pool.
+    """
+    stats = {}
+    if _engine is not None:
+        pool = _engine.pool
+        stats.update(
+            engine_open=pool.checkedin() + pool.checkedout(),
+            engine_in_use=pool.checkedout(),
+            engine_limit=pool_size() + max_overflow(),
+            engine_peak=_peak_checked_out,
+        )
+    if _pool is not None and _pool.done() and not _pool.exception():
+        pool = _pool.result()
+        stats.update(
+            asyncpg_open=pool.get_size(),
+            asyncpg_in_use=pool.get_size() - pool.get_idle_size(),
+            asyncpg_limit=pool.get_max_size(),
+        )
+    return stats
+
+
+def log_pool_stats() -> None:
+    stats = pool_stats()
+    if "engine_open" in stats:
+        logging.info(
+            f"DB engine pool: {stats['engine_in_use']} in use, {stats['engine_open']} open "
+            f"of {stats['engine_limit']}, peak {stats['engine_peak']}"
+        )
+    if "asyncpg_open" in stats:
+        logging.info(
+            f"DB asyncpg pool: {stats['asyncpg_in_use']} in use, {stats['asyncpg_open']} open "
+            f"of {stats['asyncpg_limit']}"
+        )
+
+
+class PoolMetricsService(PeriodicService):
+    """
+    Logs the utilisation of the connection pools every `interval` seconds.
+    """
+
+    def __init__(self, interval: Optional[float] = None, **kwargs: Any):
+        super().__init__(interval=interval or settings.get("db_metrics_interval", 60), **kwargs)
+
+    async def callback(self) -> None:
+        log_pool_stats()
+
+
+async def _close_on_exit(**kwargs: Any) -> None:
+    await close()
+
+
+# the services are stopped concurrently, so the connections are closed after all of them
+aiomisc.entrypoint.POST_STOP.connect(_close_on_exit)
@@ -1,6 +1,9 @@
 
-from sqlalchemy import Column, ForeignKey
-from sqlalchemy import String, Boolean, Integer
+import hashlib
+from typing import Optional
+
+from sqlalchemy import Column, ForeignKey, Index
+from sqlalchemy import String, Boolean, Integer, BigInteger, DateTime
 from sqlalchemy.orm import DeclarativeBase, relationship, declarative_base
 from sqlalchemy.testing.schema import Table
 
@@ -34,6 +37,8 @@ class Attachment(Base):
     type = Column(String)
     file = Column(String)
     autostart = Column(Boolean)
+    # id of the file uploaded to Telegram, to send it again by reference
+    telegram_file_id = Column(String)
 
     slide_id = Column(Integer, ForeignKey("slides.id"))
 
@@ -43,6 +48,10 @@ class Attachment(Base):
 
 class Slide(Base):
     __tablename__ = "slides"
+    __table_args__ = (
+        # keyset pagination of the slides of a module
+        Index("ix_slides_module_id_lessonNumber_id", "module_id", "lessonNumber", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     subjectId = Column(Integer, index=True)
@@ -50,19 +59,74 @@ class Slide(Base):
     name = Column(String)
     content = Column(String)
     formatted_content = Column(String)
+    # md5 of the content (see `content_hash`), written by the crawler and by the text processor,
+    # and the version of the processor formatted_content was made by, NULL until it's processed
+    content_hash = Column(String)
+    processed_version = Column(Integer)
+    # hash of the whole payload the crawler stored the slide from, see `crawler.payload_hash`
+    payload_hash = Column(String)
 
     module_id = Column(Integer, ForeignKey("modules.id"))
     attachments = relationship("Attachment")
     audios = relationship("AudioDubbing")
 
 
+def content_hash(content: Optional[str]) -> Optional[str]:
+    """
+    Hash the slide content the same way as md5(content) in PostgreSQL.
+    """
+    if content is None:
+        return None
+    return hashlib.md5(content.encode()).hexdigest()
+
+
 class AudioDubbing(Base):
     __tablename__ = "audio_dubbings"
 
     id = Column(Integer, primary_key=True, index=True)
     audio = Column(String)
+    # id of the file uploaded to Telegram, to send it again by reference
+    telegram_file_id = Column(String)
 
-    slide_id = Column(Integer, ForeignKey("slides.id"))
+    # one dubbing per slide, the batch and the bot may both try to store it
+    slide_id = Column(Integer, ForeignKey("slides.id"), unique=True, index=True)
 
     def __repr__(self):
         return '<AudioDubbing {}:{}>'.format(self.id, self.file)
+
+
+class ResourceValidator(Base):
+    __tablename__ = "resource_validators"
+
+    resource = Column(String, primary_key=True)
+    etag = Column(String)
+    last_modified = Column(String)
+
+    def __repr__(self):
+        return '<ResourceValidator {}:{}>'.format(self.resource, self.etag or self.last_modified)
+
+
+class AudioCacheEntry(Base):
+    __tablename__ = "audio_cache"
+
+    key = Column(String, primary_key=True)
+    path = Column(String)
+    size = Column(BigInteger)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    last_used_at = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return '<AudioCacheEntry {}:{}>'.format(self.key, self.path)
+
+
+class SynthesisFailure(Base):
+    __tablename__ = "synthesis_failures"
+
+    slide_id = Column(Integer, ForeignKey("slides.id"), primary_key=True)
+    attempts = Column(Integer, default=1)
+    error = Column(String)
+    failed_at = Column(DateTime)
+
+    def __repr__(self):
+        return '<SynthesisFailure {}:{}>'.format(self.slide_id, self.attempts)
@@ -0,0 +1,22 @@
+"""
+Notifications about changes of the course data, sent with PostgreSQL NOTIFY.
+
+A notification is delivered only when the transaction it was sent in commits,
+to every connection listening on the channel (e.g. each bot replica).
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# modules, subjects or slides were written
+COURSE_CHANGED = "course_changed"
+
+
+async def notify_course_changed(conn: AsyncConnection) -> None:
+    await conn.execute(text("SELECT pg_notify(:channel, '')"), dict(channel=COURSE_CHANGED))
+
+
+async def notify_course_changed_raw(conn) -> None:
+    """
+    The same as `notify_course_changed`, for a raw asyncpg connection.
+    """
+    await conn.execute("SELECT pg_notify($1, '')", COURSE_CHANGED)
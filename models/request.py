@@ -62,3 +62,13 @@ class ErrorResponse:
     error: Optional[str] = None
     message: Optional[str] = None
     path: Optional[str] = None
+
+
+@dataclass
+class Validators:
+    """
+    Validators of a remote resource, sent back as conditional request headers
+    """
+    resource: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
@@ -0,0 +1,31 @@
+import pytest
+
+from api.utils.html_text import bs4_strings, get_extractor, htmlparser_strings
+
+SLIDES = [
+    "",
+    "plain text without tags",
+    "<p>Kierujący pojazdem jest obowiązany zachować szczególną ostrożność.</p>",
+    "<p>Driver <b>must</b> give way to <i>pedestrians</i> on a crossing.</p>",
+    "<ul><li>Znak A-7</li><li>Znak D-1</li>\n  <li>  </li></ul>",
+    "<div><p>Pierwszy</p><br><p>Drugi<br/>wiersz</p></div>",
+    "<p>Prędkość&nbsp;50&nbsp;km/h &amp; więcej, &oacute; &#243; &#x142;</p>",
+    "<p>&unknown; &copy &ampx</p>",
+    "<p>a<!-- komentarz -->b</p><!DOCTYPE html>",
+    "<style>p { color: red; }</style><p>tekst</p><script>var a = '<p>';</script>",
+    "<template><p>ukryty</p></template><p>widoczny</p>",
+    "<p>otwarty <span>bez <b>zamknięcia",
+    "<p title='a > b'>atrybut</p></b></p>",
+    "<p><![CDATA[ dane ]]></p>",
+    "<table><tr><td>1</td><td> 2 </td></tr></table>",
+]
+
+
+@pytest.mark.parametrize("html", SLIDES)
+def test_htmlparser_matches_bs4(html):
+    assert list(htmlparser_strings(html)) == list(bs4_strings(html))
+
+
+def test_unknown_extractor():
+    with pytest.raises(ValueError):
+        get_extractor("regex")
@@ -0,0 +1,27 @@
+import pytest
+
+from api.utils.lang_fastpath import ENGLISH, POLISH, classify
+
+
+@pytest.mark.parametrize("text", [
+    "The driver must stop at the sign „Stój”",
+    "Answer: yes, the driver entering from Żelazna street must give way",
+    "In a built-up area the speed limit is fifty kilometres per hour, as on ul. Świętokrzyska",
+])
+def test_english_with_polish_names(text):
+    assert classify(text) == ENGLISH
+
+
+@pytest.mark.parametrize("text", [
+    "Stój",
+    "Kierujący pojazdem jest obowiązany zachować szczególną ostrożność",
+    "On jest obowiązany ustąpić pierwszeństwa pieszym",
+    "Czy w tej sytuacji masz obowiązek zatrzymać pojazd?",
+])
+def test_polish(text):
+    assert classify(text) == POLISH
+
+
+@pytest.mark.parametrize("text", ["", "A-7", "Stop"])
+def test_weak_evidence_left_to_langdetect(text):
+    assert classify(text) is None
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.outbound import BROADCAST, INTERACTIVE, OutboundScheduler, priority
+
+
+class FakeTelegram:
+    """
+    Stands for the rest of the request chain, records the sent methods.
+
+    The first `failures` requests are answered with a 429 asking to retry after `retry_after` seconds.
+    """
+
+    def __init__(self, failures=0, retry_after=0.05):
+        self.sent = []
+        self.failures = failures
+        self.retry_after = retry_after
+
+    async def __call__(self, bot, method):
+        if self.failures:
+            self.failures -= 1
+            raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=self.retry_after)
+        self.sent.append(method)
+        return len(self.sent)
+
+
+def markup(text):
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=text)]])
+
+
+def edit(text, message_id=1):
+    return EditMessageReplyMarkup(chat_id=1, message_id=message_id, reply_markup=markup(text))
+
+
+def blocked_scheduler(**kwargs):
+    # the requests queue up at the global gate until the block ends
+    scheduler = OutboundScheduler(global_rate=1000, **kwargs)
+    scheduler.global_bucket.block(0.05)
+    return scheduler
+
+
+def test_gate_lets_the_most_urgent_through_first():
+    async def main():
+        scheduler = blocked_scheduler()
+        telegram = FakeTelegram()
+
+        async def send(method, level):
+            with priority(level):
+                await scheduler(telegram, None, method)
+
+        await asyncio.gather(
+            send(SendMessage(chat_id=1, text="broadcast"), BROADCAST),
+            send(SendMessage(chat_id=2, text="first reply"), INTERACTIVE),
+            send(AnswerCallbackQuery(callback_query_id="1"), BROADCAST),
+            send(SendMessage(chat_id=3, text="second reply"), INTERACTIVE),
+        )
+        return telegram.sent
+
+    sent = asyncio.run(main())
+
+    assert [method.text or "answer" for method in sent] == [
+        "answer", "first reply", "second reply", "broadcast",
+    ]
+
+
+def test_waiting_edits_are_coalesced():
+    async def main():
+        scheduler = blocked_scheduler()
+        telegram = FakeTelegram()
+        results = await asyncio.gather(
+            scheduler(telegram, None, edit("a")),
+            scheduler(telegram, None, edit("b")),
+            scheduler(telegram, None, edit("other message", message_id=2)),
+        )
+        # once sent, the next edit makes a new request
+        results.append(await scheduler(telegram, None, edit("c")))
+        return telegram.sent, results
+
+    sent, results = asyncio.run(main())
+
+    assert [method.reply_markup.inline_keyboard[0][0].text for method in sent] == ["b", "other message", "c"]
+    assert results[0] == results[1]
+    assert len(set(results[1:])) == 3
+
+
+def test_retry_after_blocks_the_chat_and_retries():
+    async def main():
+        scheduler = OutboundScheduler(chat_rate=1000, max_retries=2)
+        telegram = FakeTelegram(failures=2, retry_after=0.05)
+        started = time.monotonic()
+        result = await scheduler(telegram, None, SendMessage(chat_id=1, text="hello"))
+        return result, time.monotonic() - started, telegram.sent
+
+    result, elapsed, sent = asyncio.run(main())
+
+    assert result == 1
+    assert [method.text for method in sent] == ["hello"]
+    assert elapsed >= 0.1
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def main():
+        scheduler = OutboundScheduler(chat_rate=1000, max_retries=1)
+        telegram = FakeTelegram(failures=2, retry_after=0.01)
+        await scheduler(telegram, None, SendMessage(chat_id=1, text="hello"))
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(main())
+
+
+def test_cancelled_first_editor_doesnt_cancel_the_others():
+    async def main():
+        scheduler = blocked_scheduler()
+        telegram = FakeTelegram()
+        first = asyncio.create_task(scheduler(telegram, None, edit("a")))
+        second = asyncio.create_task(scheduler(telegram, None, edit("b")))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await second
+        return first, result, telegram.sent
+
+    first, result, sent = asyncio.run(main())
+
+    assert first.cancelled()
+    assert result == 1
+    assert [method.reply_markup.inline_keyboard[0][0].text for method in sent] == ["b"]
+
+
+def test_edit_cancelled_by_all_callers_isnt_sent():
+    async def main():
+        scheduler = blocked_scheduler()
+        telegram = FakeTelegram()
+        callers = [asyncio.create_task(scheduler(telegram, None, edit(text))) for text in "ab"]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        # a later edit isn't joined to the cancelled request
+        result = await scheduler(telegram, None, edit("c"))
+        return result, telegram.sent
+
+    result, sent = asyncio.run(main())
+
+    assert result == 1
+    assert [method.reply_markup.inline_keyboard[0][0].text for method in sent] == ["c"]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from api.utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_call():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*[flight.run("key", call) for _ in range(4)])
+
+    assert asyncio.run(main()) == [1, 1, 1, 1]
+    assert len(calls) == 1
+
+
+def test_exception_is_raised_to_every_caller():
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("failed")
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*[flight.run("key", call) for _ in range(2)], return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [RuntimeError, RuntimeError]
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def call():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.run("key", call))
+        second = asyncio.create_task(flight.run("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_finished_call_is_run_again():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        flight = SingleFlight()
+        first = await flight.run("key", call)
+        await asyncio.sleep(0)
+        return first, await flight.run("key", call)
+
+    assert asyncio.run(main()) == (1, 2)
@@ -0,0 +1,161 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import aiohttp
+
+from api.utils.throttling import AIMDLimiter, RetryPolicy, Throttler, TokenBucket, parse_retry_after
+
+
+class StubResponse:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class StubSession:
+    """
+    Answers the requests with the given responses, raising the given exceptions.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    async def request(self, method, url, **kwargs):
+        self.requests += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def throttler(attempts=3):
+    return Throttler(rate=1000, retry=RetryPolicy(attempts=attempts, base_delay=0.001, max_delay=0.001))
+
+
+async def request(throttler, session):
+    async with throttler.request(session, "GET", "https://example.com/", endpoint="test") as response:
+        return response
+
+
+def test_bucket_allows_a_burst_of_its_capacity():
+    async def main():
+        bucket = TokenBucket(rate=10, capacity=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.05
+    # the fourth token is refilled after 1 / rate seconds
+    assert 0.08 <= total < 0.2
+
+
+def test_bucket_below_one_token_per_second_holds_one_token():
+    async def main():
+        bucket = TokenBucket(rate=0.5)
+        await asyncio.wait_for(bucket.acquire(), timeout=0.1)
+        return bucket.capacity
+
+    assert asyncio.run(main()) == 1
+
+
+def test_block_empties_the_bucket():
+    async def main():
+        bucket = TokenBucket(rate=1000)
+        bucket.block(0.1)
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert 0.09 <= asyncio.run(main()) < 0.2
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after("-1") == 0
+
+
+def test_parse_retry_after_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 28 <= parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+def test_parse_retry_after_malformed():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_aimd_increases_additively():
+    limiter = AIMDLimiter(initial=4, maximum=5)
+    for _ in range(4):
+        limiter.on_success()
+    assert 4.9 < limiter.limit <= 5
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.limit == 5
+
+
+def test_aimd_merges_decreases_within_the_cooldown():
+    limiter = AIMDLimiter(initial=16, cooldown=60)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 8
+
+
+def test_aimd_decreases_again_after_the_cooldown():
+    limiter = AIMDLimiter(initial=16, minimum=2, cooldown=0)
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.limit == 2
+
+
+def test_request_retries_until_success():
+    session = StubSession(StubResponse(503), aiohttp.ClientConnectionError(), StubResponse(200))
+    response = asyncio.run(request(throttler(), session))
+    assert response.status == 200
+    assert session.requests == 3
+
+
+def test_request_returns_the_last_error_response():
+    session = StubSession(StubResponse(500), StubResponse(502))
+    response = asyncio.run(request(throttler(attempts=2), session))
+    assert response.status == 502
+    assert session.requests == 2
+
+
+def test_request_does_not_retry_client_errors():
+    session = StubSession(StubResponse(404), StubResponse(200))
+    response = asyncio.run(request(throttler(), session))
+    assert response.status == 404
+    assert session.requests == 1
+
+
+def test_request_honours_retry_after():
+    async def main():
+        limiter = throttler()
+        session = StubSession(StubResponse(429, {"Retry-After": "0.1"}), StubResponse(200))
+        start = time.monotonic()
+        response = await request(limiter, session)
+        return response, time.monotonic() - start, limiter.concurrency.limit
+
+    response, elapsed, limit = asyncio.run(main())
+    assert response.status == 200
+    assert elapsed >= 0.09
+    # halved by the 429, grown back a little by the success
+    assert limit == 2.5